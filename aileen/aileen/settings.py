@@ -199,6 +199,70 @@ SENSOR_LOG_INTERVAL_IN_SECONDS = int(
     os.environ.get("AILEEN_SENSOR_LOG_INTERVAL_IN_SECONDS", default=5)
 )
 
+# Instead of reading sensor data every SENSOR_LOG_INTERVAL_IN_SECONDS, the recorder can wait until the sensor
+# wrote to its files (Linux only, needs the inotify_simple package). It waits until the sensor has stopped writing
+# for the debounce period, but processes new data at the latest after the maximal latency.
+SENSOR_WATCH_FILES = (
+    os.environ.get("AILEEN_SENSOR_WATCH_FILES", default="False") in TRUTH_STRINGS
+)
+SENSOR_WATCH_DEBOUNCE_IN_SECONDS = float(
+    os.environ.get("AILEEN_SENSOR_WATCH_DEBOUNCE_IN_SECONDS", default=1)
+)
+SENSOR_WATCH_MAX_LATENCY_IN_SECONDS = float(
+    os.environ.get(
+        "AILEEN_SENSOR_WATCH_MAX_LATENCY_IN_SECONDS",
+        default=SENSOR_LOG_INTERVAL_IN_SECONDS,
+    )
+)
+
+# whether to write the observables (and events) of each sensor reading with a few set-based statements,
+# instead of row by row. Recommended on busy sites, where row-by-row writing can take longer than the interval.
+BULK_DB_WRITES = (
+    os.environ.get("AILEEN_BULK_DB_WRITES", default="False") in TRUTH_STRINGS
+)
+
+# The recorder remembers observables in memory. Those not seen for this long are forgotten (to bound memory use).
+OBSERVABLE_CACHE_RETENTION_IN_SECONDS = int(
+    os.environ.get("AILEEN_OBSERVABLE_CACHE_RETENTION_IN_SECONDS", default=24 * 60 * 60)
+)
+
+# How the aggregator counts observables seen in an hour/day and in preceding ones:
+# "sql" lets the database count and intersect in one query, "bitmap" combines stored bitmaps of the observables
+# seen per hour, "python" intersects sets of IDs in memory.
+AGGREGATION_BACKEND = os.environ.get("AILEEN_AGGREGATION_BACKEND", default="sql")
+# The aggregator also stores bitmaps of the observables seen per day, which return curves are computed from
+# (on by default with the "bitmap" backend, which stores the observable numbers they need anyway)
+AGGREGATION_DAY_BITMAPS = (
+    os.environ.get(
+        "AILEEN_AGGREGATION_DAY_BITMAPS", default=str(AGGREGATION_BACKEND == "bitmap")
+    )
+    in TRUTH_STRINGS
+)
+
+# Attach a HyperLogLog sketch of the observables seen to each hourly aggregation,
+# so unique observables can be estimated for long time ranges and many boxes
+AGGREGATION_SKETCHES = (
+    os.environ.get("AILEEN_AGGREGATION_SKETCHES", default="False") in TRUTH_STRINGS
+)
+
+# In incremental mode, the recorder keeps the aggregations of the current and preceding hour/day up to date
+# as it writes events, and the aggregator only catches up on older hours and days.
+INCREMENTAL_AGGREGATION = (
+    os.environ.get("AILEEN_INCREMENTAL_AGGREGATION", default="False") in TRUTH_STRINGS
+)
+# In incremental mode, the recorder reloads what it counted from the database this often (to correct drift)
+AGGREGATION_RECONCILIATION_INTERVAL_IN_SECONDS = int(
+    os.environ.get(
+        "AILEEN_AGGREGATION_RECONCILIATION_INTERVAL_IN_SECONDS", default=60 * 60
+    )
+)
+
+# How many days the aggregator looks back for hours and days which still need to be aggregated
+# (e.g. after an outage of the aggregator)
+AGGREGATION_LOOK_BACK_IN_DAYS = int(
+    os.environ.get("AILEEN_AGGREGATION_LOOK_BACK_IN_DAYS", default=7)
+)
+
 # if this is false, no uploading will take place
 INTERNET_CONNECTION_AVAILABLE = (
     os.environ.get("AILEEN_INTERNET_CONNECTION_AVAILABLE", default="yes")
@@ -211,6 +275,54 @@ UPLOAD_INTERVAL_IN_SECONDS = int(
 UPLOAD_MAX_NUMBER_PER_REQUEST = int(
     os.environ.get("AILEEN_UPLOAD_MAX_NUMBER_PER_REQUEST", default=500)
 )
+# Event batches are sized so that a request takes about this long, within these bounds
+UPLOAD_TARGET_REQUEST_DURATION_IN_SECONDS = float(
+    os.environ.get("AILEEN_UPLOAD_TARGET_REQUEST_DURATION_IN_SECONDS", default=10)
+)
+UPLOAD_MIN_NUMBER_PER_REQUEST = int(
+    os.environ.get("AILEEN_UPLOAD_MIN_NUMBER_PER_REQUEST", default=50)
+)
+UPLOAD_MAX_EVENTS_PER_REQUEST = int(
+    os.environ.get("AILEEN_UPLOAD_MAX_EVENTS_PER_REQUEST", default=20_000)
+)
+# Event batches are also kept below this many bytes - the server rejects requests over
+# its DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 MB by default in Django)
+UPLOAD_MAX_BYTES_PER_REQUEST = int(
+    os.environ.get("AILEEN_UPLOAD_MAX_BYTES_PER_REQUEST", default=2_000_000)
+)
+# Uploads time out if the server cannot be reached in UPLOAD_CONNECT_TIMEOUT_IN_SECONDS or does not respond in time
+UPLOAD_CONNECT_TIMEOUT_IN_SECONDS = float(
+    os.environ.get("AILEEN_UPLOAD_CONNECT_TIMEOUT_IN_SECONDS", default=10)
+)
+UPLOAD_READ_TIMEOUT_IN_SECONDS = float(
+    os.environ.get("AILEEN_UPLOAD_READ_TIMEOUT_IN_SECONDS", default=60)
+)
+# Failed uploads are retried, after an exponential backoff (with jitter)
+UPLOAD_MAX_RETRIES = int(os.environ.get("AILEEN_UPLOAD_MAX_RETRIES", default=3))
+UPLOAD_BACKOFF_BASE_IN_SECONDS = float(
+    os.environ.get("AILEEN_UPLOAD_BACKOFF_BASE_IN_SECONDS", default=1)
+)
+UPLOAD_BACKOFF_MAX_IN_SECONDS = float(
+    os.environ.get("AILEEN_UPLOAD_BACKOFF_MAX_IN_SECONDS", default=60)
+)
+# After this many failed uploads in a row, we pause uploading for a while
+UPLOAD_CIRCUIT_BREAKER_THRESHOLD = int(
+    os.environ.get("AILEEN_UPLOAD_CIRCUIT_BREAKER_THRESHOLD", default=5)
+)
+UPLOAD_CIRCUIT_BREAKER_RESET_IN_SECONDS = float(
+    os.environ.get("AILEEN_UPLOAD_CIRCUIT_BREAKER_RESET_IN_SECONDS", default=300)
+)
+# About how many bytes of events we upload at most per upload interval (0 means no limit)
+UPLOAD_BUDGET_IN_BYTES_PER_INTERVAL = int(
+    os.environ.get("AILEEN_UPLOAD_BUDGET_IN_BYTES_PER_INTERVAL", default=0)
+)
+# Batches which could not be uploaded are kept in this directory (up to a size), to be uploaded later
+UPLOAD_SPOOL_DIR = os.environ.get(
+    "AILEEN_UPLOAD_SPOOL_DIR", default=os.path.join(BASE_DIR, "upload_spool")
+)
+UPLOAD_SPOOL_MAX_SIZE_IN_MB = float(
+    os.environ.get("AILEEN_UPLOAD_SPOOL_MAX_SIZE_IN_MB", default=100)
+)
 STATUS_MONITORING_INTERVAL_IN_SECONDS = int(
     os.environ.get("AILEEN_STATUS_MONITORING_INTERVAL_IN_SECONDS", default=60)
 )
@@ -234,8 +346,43 @@ HASH_ITERATIONS = int(
     os.environ.get("AILEEN_HASH_ITERATIONS", default=500_000)
 )  # 2013 they recommended "at least 100000"
 
+# how many hashed observable IDs to keep in memory
+HASH_MEMO_MAX_SIZE = int(os.environ.get("AILEEN_HASH_MEMO_MAX_SIZE", default=100_000))
+# whether to also store all hashed observable IDs in the database, so restarts stay warm (see the Readme)
+HASH_MEMO_ON_DISK = (
+    os.environ.get("AILEEN_HASH_MEMO_ON_DISK", default="False") in TRUTH_STRINGS
+)
+
+# how many processes hash observable IDs when many new ones come in at once (0 means: one per CPU core)
+HASH_WORKERS = int(os.environ.get("AILEEN_HASH_WORKERS", default=0))
+
 # whether boxes should upload events to the server (otherwise just aggregations)
 UPLOAD_EVENTS = os.environ.get("AILEEN_UPLOAD_EVENTS", default="False") in TRUTH_STRINGS
+# whether to upload events in the compact format (see data/wire_format.py), if the server understands it
+UPLOAD_COMPACT_EVENTS = (
+    os.environ.get("AILEEN_UPLOAD_COMPACT_EVENTS", default="yes") in TRUTH_STRINGS
+)
+# the server rejects compact uploads which decompress to more than this many bytes
+UPLOAD_MAX_DECOMPRESSED_BYTES = int(
+    os.environ.get("AILEEN_UPLOAD_MAX_DECOMPRESSED_BYTES", default=50_000_000)
+)
+
+# Events older than this many days are moved out of the database into compressed files (0 keeps them all)
+EVENTS_RETENTION_IN_DAYS = int(
+    os.environ.get("AILEEN_EVENTS_RETENTION_IN_DAYS", default=0)
+)
+EVENTS_ARCHIVE_DIR = os.environ.get(
+    "AILEEN_EVENTS_ARCHIVE_DIR", default=os.path.join(BASE_DIR, "events_archive")
+)
+# "npz" (compressed numpy files) or "sqlite" (SQLite files, which are quicker to query by time)
+EVENTS_ARCHIVE_FORMAT = os.environ.get("AILEEN_EVENTS_ARCHIVE_FORMAT", default="npz")
+# Archived days older than this many days are deleted, a whole day at a time (0 keeps them all)
+EVENTS_ARCHIVE_RETENTION_IN_DAYS = int(
+    os.environ.get("AILEEN_EVENTS_ARCHIVE_RETENTION_IN_DAYS", default=0)
+)
+EVENTS_ARCHIVE_INTERVAL_IN_SECONDS = int(
+    os.environ.get("AILEEN_EVENTS_ARCHIVE_INTERVAL_IN_SECONDS", default=6 * 60 * 60)
+)
 
 # For tmux sessions and writing info to DB
 TMUX_SESSION_NAME = "aileen_tmux_session"
@@ -3,3 +3,4 @@ from django.contrib import admin
 from box import models
 
 admin.site.register(models.BoxSettings)
+admin.site.register(models.UploadChannelStatus)
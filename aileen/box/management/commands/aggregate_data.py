@@ -1,45 +1,70 @@
 import logging
 import time
 from datetime import datetime, timedelta
-from typing import List
+from typing import List, Tuple
 
-import pandas as pd
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
 from box.models import BoxSettings
+from box.utils.outbox import append_to_outbox
+from data.archive import has_archived_events
+from data.bitmaps import (
+    build_closed_day_bitmaps,
+    count_unique_observables_seen_in_bitmaps,
+)
 from data.models import SeenByDay, SeenByHour, TmuxStatus
-from data.queries import get_unique_observable_ids_seen
+from data.queries import count_unique_observables_seen, get_unique_observable_ids_seen
+from data.sketches import HyperLogLog
 from data.time_utils import (
     as_day,
     as_hour,
     get_most_recent_hour,
+    get_timezone,
+    naive_utc_from,
     sleep_until_interval_is_complete,
 )
 
 logger = logging.getLogger(__name__)
 
 
+def count_seen(
+    box_id: str, window: Tuple[datetime, datetime], other_windows: List[Tuple]
+) -> List[int]:
+    """Count the observables seen in the time window, and how many of them were also seen in each of
+    the other windows. Depending on AGGREGATION_BACKEND, the database computes this in one query ("sql"),
+    we combine bitmaps of the observables seen per hour ("bitmap"),
+    or we load the distinct IDs of each window and intersect them as sets ("python").
+    If events in the windows were archived already, the database cannot see them, so we use sets then."""
+    archived = any(
+        has_archived_events(box_id, start_time, end_time)
+        for start_time, end_time in [window] + list(other_windows)
+    )
+    if settings.AGGREGATION_BACKEND == "sql" and not archived:
+        return count_unique_observables_seen(
+            box_id, *window, also_seen_between=other_windows
+        )
+    if settings.AGGREGATION_BACKEND == "bitmap":
+        return count_unique_observables_seen_in_bitmaps(
+            box_id, *window, also_seen_between=other_windows
+        )
+    seen = set(get_unique_observable_ids_seen(box_id, *window))
+    return [len(seen)] + [
+        len(seen.intersection(get_unique_observable_ids_seen(box_id, *other_window)))
+        for other_window in other_windows
+    ]
+
+
 def aggregate_hour(hour_start: datetime) -> SeenByHour:
     """Aggregate hourly seen events for the hour starting at the passed time."""
     box_settings = BoxSettings.objects.first()
 
-    unique_observable_ids_this_hour = get_unique_observable_ids_seen(
-        box_id=box_settings.box_id,
-        start_time=hour_start,
-        end_time=hour_start + timedelta(hours=1),
-    )
-    unique_observable_ids_preceding_hour = get_unique_observable_ids_seen(
-        box_id=box_settings.box_id,
-        start_time=hour_start - timedelta(hours=1),
-        end_time=hour_start,
+    seen, seen_also_in_preceding_hour = count_seen(
+        box_settings.box_id,
+        (hour_start, hour_start + timedelta(hours=1)),
+        [(hour_start - timedelta(hours=1), hour_start)],
     )
-    seen_in_both = [
-        observable_id
-        for observable_id in unique_observable_ids_this_hour
-        if observable_id in unique_observable_ids_preceding_hour
-    ]
 
     aggregation = SeenByHour(box_id=box_settings.box_id, hour_start=hour_start)
     existing_aggregation = (
@@ -50,8 +75,14 @@ def aggregate_hour(hour_start: datetime) -> SeenByHour:
     if existing_aggregation:
         aggregation = existing_aggregation
 
-    aggregation.seen = len(unique_observable_ids_this_hour)
-    aggregation.seen_also_in_preceding_hour = len(seen_in_both)
+    aggregation.seen = seen
+    aggregation.seen_also_in_preceding_hour = seen_also_in_preceding_hour
+    if settings.AGGREGATION_SKETCHES:
+        aggregation.sketch = HyperLogLog.from_observable_ids(
+            get_unique_observable_ids_seen(
+                box_settings.box_id, hour_start, hour_start + timedelta(hours=1)
+            )
+        ).to_bytes()
 
     return aggregation
 
@@ -59,32 +90,15 @@ def aggregate_hour(hour_start: datetime) -> SeenByHour:
 def aggregate_day(day_start: datetime) -> SeenByDay:
     """Aggregate daily seen events for the day starting at the passed time."""
     box_settings = BoxSettings.objects.first()
-    unique_observable_ids_today = get_unique_observable_ids_seen(
-        box_id=box_settings.box_id,
-        start_time=day_start,
-        end_time=day_start + timedelta(days=1),
-    )
-    unique_observable_ids_preceding_day = get_unique_observable_ids_seen(
-        box_id=box_settings.box_id,
-        start_time=day_start - timedelta(days=1),
-        end_time=day_start,
-    )
-    seen_both_today_and_yesterday = [
-        observable_id
-        for observable_id in unique_observable_ids_today
-        if observable_id in unique_observable_ids_preceding_day
-    ]
 
-    unique_observable_ids_a_week_earlier = get_unique_observable_ids_seen(
-        box_id=box_settings.box_id,
-        start_time=day_start - timedelta(days=7),
-        end_time=day_start - timedelta(days=6),
+    seen, seen_also_on_preceding_day, seen_also_a_week_earlier = count_seen(
+        box_settings.box_id,
+        (day_start, day_start + timedelta(days=1)),
+        [
+            (day_start - timedelta(days=1), day_start),
+            (day_start - timedelta(days=7), day_start - timedelta(days=6)),
+        ],
     )
-    seen_both_today_and_a_week_earlier = [
-        observable_id
-        for observable_id in unique_observable_ids_today
-        if observable_id in unique_observable_ids_a_week_earlier
-    ]
 
     aggregation = SeenByDay(box_id=box_settings.box_id, day_start=day_start)
     existing_aggregation = (
@@ -95,57 +109,53 @@ def aggregate_day(day_start: datetime) -> SeenByDay:
     if existing_aggregation:
         aggregation = existing_aggregation
 
-    aggregation.seen = len(unique_observable_ids_today)
-    aggregation.seen_also_on_preceding_day = len(seen_both_today_and_yesterday)
-    aggregation.seen_also_a_week_earlier = len(seen_both_today_and_a_week_earlier)
+    aggregation.seen = seen
+    aggregation.seen_also_on_preceding_day = seen_also_on_preceding_day
+    aggregation.seen_also_a_week_earlier = seen_also_a_week_earlier
 
     return aggregation
 
 
+def get_unaggregated_buckets(
+    aggregation_model, bucket_field: str, kind: str, first: datetime, last: datetime
+) -> List[datetime]:
+    """Find the buckets (hours or days, by their start time) from first until last which have no aggregation yet,
+    but in which the sensor was on at some time. We need two queries, however long we look back:
+    one for the buckets we aggregated, one for the buckets (in our timezone) with a positive sensor status."""
+    box_settings = BoxSettings.objects.first()
+    bucket_length = timedelta(hours=1) if kind == "hour" else timedelta(days=1)
+    aggregated_buckets = {
+        naive_utc_from(bucket_start)
+        for bucket_start in aggregation_model.objects.filter(box_id=box_settings.box_id)
+        .filter(**{f"{bucket_field}__gte": first})
+        .filter(**{f"{bucket_field}__lte": last})
+        .values_list(bucket_field, flat=True)
+    }
+    buckets_with_sensor_on = (
+        TmuxStatus.objects.filter(time_stamp__gte=first)
+        .filter(time_stamp__lt=last + bucket_length)
+        .filter(sensor_status=True)
+        .datetimes("time_stamp", kind, tzinfo=get_timezone())
+    )
+    return [
+        bucket_start
+        for bucket_start in buckets_with_sensor_on
+        if naive_utc_from(bucket_start) not in aggregated_buckets
+    ]
+
+
 def get_unaggregated_hours(dt_from: datetime, dt_until: datetime) -> List[datetime]:
     """Look back in time to see which hours (start time) are not yet aggregated, but should be."""
-    hours_without_aggregations = []
-    box_settings = BoxSettings.objects.first()
-    for hour in pd.date_range(as_hour(dt_from), as_hour(dt_until), freq="1H"):
-        aggregation = (
-            SeenByHour.objects.filter(box_id=box_settings.box_id)
-            .filter(hour_start=hour)
-            .first()
-        )
-        if aggregation is None:
-            # add this hour to be aggregated - if sensor was on at any time during.
-            if (
-                TmuxStatus.objects.filter(time_stamp__gte=hour)
-                .filter(time_stamp__lt=hour + timedelta(hours=1))
-                .filter(sensor_status=True)
-                .count()
-                > 0
-            ):
-                hours_without_aggregations.append(hour)
-    return hours_without_aggregations
+    return get_unaggregated_buckets(
+        SeenByHour, "hour_start", "hour", as_hour(dt_from), as_hour(dt_until)
+    )
 
 
 def get_unaggregated_days(dt_from: datetime, dt_until: datetime) -> List[datetime]:
     """Look back in time to see which days (start time) are not yet aggregated, but should be."""
-    days_without_integration = []
-    box_settings = BoxSettings.objects.first()
-    for day in pd.date_range(as_day(dt_from), as_day(dt_until), freq="1D"):
-        aggregation = (
-            SeenByDay.objects.filter(box_id=box_settings.box_id)
-            .filter(day_start=day)
-            .first()
-        )
-        if aggregation is None:
-            # add this day to be aggregated - if sensor was on at any time during.
-            if (
-                TmuxStatus.objects.filter(time_stamp__gte=day)
-                .filter(time_stamp__lt=day + timedelta(hours=24))
-                .filter(sensor_status=True)
-                .count()
-                > 0
-            ):
-                days_without_integration.append(day)
-    return days_without_integration
+    return get_unaggregated_buckets(
+        SeenByDay, "day_start", "day", as_day(dt_from), as_day(dt_until)
+    )
 
 
 def aggregate_data_to_db():
@@ -154,26 +164,46 @@ def aggregate_data_to_db():
     while True:
         start_time = time.time()
         recent_hour = get_most_recent_hour()
+        # catch up on yet unaggregated data, by default until a week back
         look_back_until = recent_hour - timedelta(
-            hours=7 * 24
-        )  # catch up until a week of yet unaggregated data
+            days=settings.AGGREGATION_LOOK_BACK_IN_DAYS
+        )
 
         # This aggregates all unaggregated hours/days up until the preceding one, plus the currently active one.
+        # In incremental mode, the recorder keeps the current ones up to date.
+        current_hours, current_days = [], []
+        if not settings.INCREMENTAL_AGGREGATION:
+            current_hours = [get_most_recent_hour()]
+            current_days = [get_most_recent_hour().replace(hour=0)]
         with transaction.atomic():
-            for hour in get_unaggregated_hours(
-                look_back_until, recent_hour - timedelta(hours=1)
-            ) + [get_most_recent_hour()]:
+            for hour in (
+                get_unaggregated_hours(
+                    look_back_until, recent_hour - timedelta(hours=1)
+                )
+                + current_hours
+            ):
                 seen_by_hour = aggregate_hour(hour)
                 seen_by_hour.save()
+                append_to_outbox("seen_by_hour", [seen_by_hour.id])
                 logger.info(f"Saved {seen_by_hour}")
 
-            for day in get_unaggregated_days(
-                look_back_until, recent_hour - timedelta(hours=24)
-            ) + [get_most_recent_hour().replace(hour=0)]:
+            for day in (
+                get_unaggregated_days(
+                    look_back_until, recent_hour - timedelta(hours=24)
+                )
+                + current_days
+            ):
                 seen_by_day = aggregate_day(day)
                 seen_by_day.save()
+                append_to_outbox("seen_by_day", [seen_by_day.id])
                 logger.info(f"Saved {seen_by_day}")
 
+            # for return curves (see data/bitmaps.py)
+            if settings.AGGREGATION_DAY_BITMAPS:
+                build_closed_day_bitmaps(
+                    BoxSettings.objects.first().box_id, look_back_until
+                )
+
         sleep_until_interval_is_complete(
             start_time, settings.UPLOAD_INTERVAL_IN_SECONDS
         )
@@ -0,0 +1,174 @@
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytz
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from box.models import BoxSettings
+from box.utils.outbox import remove_from_outbox
+from data.archive import drop_archived_days, write_archived_day
+from data.db_utils import in_batches
+from data.models import Events, SeenByDay, SeenByHour
+from data.time_utils import (
+    aileen_now,
+    get_timezone,
+    naive_utc_from,
+    sleep_until_interval_is_complete,
+)
+
+"""
+Move raw events which are older than the retention period out of the database, into the archive (see data/archive.py).
+This keeps the database on the box small. We only move events which are aggregated already
+and (if we upload events) uploaded. Archived days older than the archive retention period are dropped.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def get_first_unaggregated(
+    box_id: str, events, aggregation_model, bucket_field: str, kind: str
+):
+    """The start of the first hour or day in which some of these events happened, but which is not aggregated."""
+    aggregated_buckets = set(
+        naive_utc_from(bucket_start)
+        for bucket_start in aggregation_model.objects.filter(box_id=box_id).values_list(
+            bucket_field, flat=True
+        )
+    )
+    for bucket_start in events.datetimes("time_seen", kind, tzinfo=get_timezone()):
+        if naive_utc_from(bucket_start) not in aggregated_buckets:
+            return bucket_start
+    return None
+
+
+def get_archivable_events(box_settings: BoxSettings, archive_before: datetime):
+    events = Events.objects.filter(box_id=box_settings.box_id).filter(
+        time_seen__lt=archive_before
+    )
+    # the box settings refer to the last uploaded event, so it has to stay
+    if box_settings.events_uploaded_until_id is not None:
+        events = events.exclude(id=box_settings.events_uploaded_until_id)
+    if settings.UPLOAD_EVENTS:
+        if box_settings.events_uploaded_until_id is None:
+            return events.none()
+        events = events.filter(id__lt=box_settings.events_uploaded_until_id)
+    if not events.exists():
+        return events
+    for aggregation_model, bucket_field, kind in (
+        (SeenByHour, "hour_start", "hour"),
+        (SeenByDay, "day_start", "day"),
+    ):
+        first_unaggregated = get_first_unaggregated(
+            box_settings.box_id, events, aggregation_model, bucket_field, kind
+        )
+        if first_unaggregated is not None:
+            events = events.filter(time_seen__lt=first_unaggregated)
+    return events
+
+
+def archive_events(retention_in_days: int) -> int:
+    """Archive events older than the retention period, one UTC day at a time. Returns how many were archived."""
+    box_settings = BoxSettings.objects.first()
+    if box_settings is None:
+        logger.error("No box settings found. Please create some in the admin panel.")
+        return 0
+    # we archive whole (UTC) days
+    archive_before = (
+        naive_utc_from(aileen_now() - timedelta(days=retention_in_days))
+        .replace(hour=0, minute=0, second=0, microsecond=0)
+        .replace(tzinfo=pytz.utc)
+    )
+    events = get_archivable_events(box_settings, archive_before)
+
+    archived = 0
+    for day in events.datetimes("time_seen", "day", tzinfo=pytz.utc):
+        day_events = events.filter(time_seen__gte=day).filter(
+            time_seen__lt=day + timedelta(days=1)
+        )
+        events_df = pd.DataFrame(
+            list(
+                day_events.values_list(
+                    "id", "observable_id", "time_seen", "value", "observations"
+                )
+            ),
+            columns=["id", "observable_id", "time_seen", "value", "observations"],
+        )
+        events_df["time_seen"] = pd.to_datetime(events_df["time_seen"], utc=True).map(
+            lambda time_seen: time_seen.value
+        )
+        events_df["observations"] = events_df["observations"].map(
+            lambda observations: observations
+            if isinstance(observations, str)
+            else json.dumps(observations)
+        )
+        # first the archive, then the database - if we fail in between, we archive these events again next time
+        write_archived_day(box_settings.box_id, day.date(), events_df)
+        with transaction.atomic():
+            for batch in in_batches(events_df["id"].tolist()):
+                Events.objects.filter(id__in=batch).delete()
+            # these events will not be uploaded anymore (e.g. while UPLOAD_EVENTS is off)
+            remove_from_outbox("events", events_df["id"].tolist())
+        logger.info(f"Archived {len(events_df.index)} events of {day.date()}.")
+        archived += len(events_df.index)
+    return archived
+
+
+def drop_old_archived_days(box_id: str, archive_retention_in_days: int) -> int:
+    """Delete archived days older than the archive retention period (whole partitions at once)."""
+    drop_before = naive_utc_from(
+        aileen_now() - timedelta(days=archive_retention_in_days)
+    ).date()
+    dropped = drop_archived_days(box_id, drop_before)
+    if dropped > 0:
+        logger.info(f"Dropped {dropped} archived day(s) before {drop_before}.")
+    return dropped
+
+
+class Command(BaseCommand):
+    help = "Move raw events older than the retention period out of the database, into compressed files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-in-days",
+            type=int,
+            default=settings.EVENTS_RETENTION_IN_DAYS,
+            help="Keep events of this many recent days in the database (default: AILEEN_EVENTS_RETENTION_IN_DAYS).",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep archiving, every AILEEN_EVENTS_ARCHIVE_INTERVAL_IN_SECONDS.",
+        )
+
+    def handle(self, *args, **options):
+        if options["retention_in_days"] <= 0:
+            logger.error(
+                "No retention period set (AILEEN_EVENTS_RETENTION_IN_DAYS), not archiving."
+            )
+            return
+        logger.info(
+            f"{settings.TERM_LBL} Archiving events older than {options['retention_in_days']} days"
+            f" to {settings.EVENTS_ARCHIVE_DIR} ..."
+        )
+        while True:
+            start_time = time.time()
+            archived = archive_events(options["retention_in_days"])
+            logger.info(f"Archived {archived} events.")
+            box_settings = BoxSettings.objects.first()
+            if (
+                box_settings is not None
+                and settings.EVENTS_ARCHIVE_RETENTION_IN_DAYS > 0
+            ):
+                drop_old_archived_days(
+                    box_settings.box_id, settings.EVENTS_ARCHIVE_RETENTION_IN_DAYS
+                )
+            if not options["loop"]:
+                return
+            sleep_until_interval_is_complete(
+                start_time, settings.EVENTS_ARCHIVE_INTERVAL_IN_SECONDS
+            )
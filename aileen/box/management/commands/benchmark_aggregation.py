@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from data.bitmaps import count_unique_observables_seen_in_bitmaps
+from data.models import Events, Observables
+from data.queries import count_unique_observables_seen, get_unique_observable_ids_seen
+from data.time_utils import as_hour, aileen_now
+
+"""
+Measure how long it takes to count the observables seen in an hour, and how many of them were seen in the
+preceding hour - the old way (intersecting lists), with Python sets, in the database (one query) and with bitmaps.
+We write synthetic events in a transaction which is rolled back in the end, so the database is left untouched.
+"""
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_BOX_ID = "benchmark-box"
+
+
+def make_events(num_observables: int, hour_start, overlap: float):
+    """Write events for num_observables in the hour before hour_start and in the hour starting at hour_start.
+    The given share of observables is seen in both hours."""
+    observable_ids = [
+        hashlib.sha256(str(i).encode()).hexdigest() for i in range(num_observables)
+    ]
+    Observables.objects.bulk_create(
+        [
+            Observables(observable_id=observable_id, time_last_seen=hour_start)
+            for observable_id in observable_ids
+        ],
+        batch_size=300,
+    )
+    num_in_both = int(overlap * num_observables / 2)
+    preceding_hour_ids = observable_ids[: num_observables // 2]
+    this_hour_ids = observable_ids[num_observables // 2 - num_in_both :]
+    events = []
+    for ids, start in (
+        (preceding_hour_ids, hour_start - timedelta(hours=1)),
+        (this_hour_ids, hour_start),
+    ):
+        for observable_id in ids:
+            events.append(
+                Events(
+                    box_id=BENCHMARK_BOX_ID,
+                    time_seen=start + timedelta(seconds=random.randint(1, 3599)),
+                    observable_id=observable_id,
+                    value=0,
+                    observations={},
+                )
+            )
+    Events.objects.bulk_create(events, batch_size=300)
+
+
+def count_with_lists(hour_start):
+    """What the aggregator used to do. Membership tests on a list make this quadratic."""
+    this_hour = get_unique_observable_ids_seen(
+        BENCHMARK_BOX_ID, hour_start, hour_start + timedelta(hours=1)
+    )
+    preceding_hour = get_unique_observable_ids_seen(
+        BENCHMARK_BOX_ID, hour_start - timedelta(hours=1), hour_start
+    )
+    return [len(this_hour), len([oid for oid in this_hour if oid in preceding_hour])]
+
+
+def count_with_sets(hour_start):
+    this_hour = set(
+        get_unique_observable_ids_seen(
+            BENCHMARK_BOX_ID, hour_start, hour_start + timedelta(hours=1)
+        )
+    )
+    preceding_hour = get_unique_observable_ids_seen(
+        BENCHMARK_BOX_ID, hour_start - timedelta(hours=1), hour_start
+    )
+    return [len(this_hour), len(this_hour.intersection(preceding_hour))]
+
+
+def count_with_bitmaps(hour_start):
+    """Includes building the bitmaps of both hours, as they are recent."""
+    return count_unique_observables_seen_in_bitmaps(
+        BENCHMARK_BOX_ID,
+        hour_start,
+        hour_start + timedelta(hours=1),
+        also_seen_between=[(hour_start - timedelta(hours=1), hour_start)],
+    )
+
+
+def count_with_sql(hour_start):
+    return count_unique_observables_seen(
+        BENCHMARK_BOX_ID,
+        hour_start,
+        hour_start + timedelta(hours=1),
+        also_seen_between=[(hour_start - timedelta(hours=1), hour_start)],
+    )
+
+
+class Command(BaseCommand):
+    help = "Benchmark the ways to count observables seen in an hour and in the preceding hour."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[1000, 10000],
+            help="Numbers of observables seen in the two hours.",
+        )
+        parser.add_argument(
+            "--overlap",
+            type=float,
+            default=0.5,
+            help="Share of observables seen in both hours.",
+        )
+        parser.add_argument(
+            "--skip-lists",
+            action="store_true",
+            help="Do not measure the old way (it takes very long for large sizes).",
+        )
+
+    def handle(self, *args, **options):
+        methods = [
+            ("sets", count_with_sets),
+            ("sql", count_with_sql),
+            ("bitmaps", count_with_bitmaps),
+        ]
+        if not options["skip_lists"]:
+            methods.insert(0, ("lists", count_with_lists))
+        hour_start = as_hour(aileen_now()) - timedelta(days=365)
+        for num_observables in options["sizes"]:
+            with transaction.atomic():
+                make_events(num_observables, hour_start, options["overlap"])
+                for name, count in methods:
+                    start_time = time.time()
+                    seen, seen_also_in_preceding_hour = count(hour_start)
+                    logger.info(
+                        "%d observables, %s: counted %d seen (%d also in the preceding hour) in %.2f s."
+                        % (
+                            num_observables,
+                            name,
+                            seen,
+                            seen_also_in_preceding_hour,
+                            time.time() - start_time,
+                        )
+                    )
+                transaction.set_rollback(True)
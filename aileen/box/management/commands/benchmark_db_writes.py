@@ -0,0 +1,99 @@
+import hashlib
+import logging
+import time
+from datetime import timedelta
+
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from data.models import Observables
+from data.time_utils import aileen_now
+
+"""
+Measure how long the recorder needs to write the observables of one sensor reading, in row-by-row and bulk mode.
+Everything happens in a transaction which is rolled back in the end, so the database is left untouched.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def make_observables_df(num_observables: int, time_seen) -> pd.DataFrame:
+    """Observables as the recorder would save them, with hashed-looking IDs.
+    Like sensors do, we report times at a resolution of seconds, spread over one sensor log interval."""
+    return pd.DataFrame(
+        dict(
+            time_last_seen=[
+                time_seen.replace(microsecond=0)
+                - timedelta(seconds=i % settings.SENSOR_LOG_INTERVAL_IN_SECONDS)
+                for i in range(num_observables)
+            ]
+        ),
+        index=pd.Index(
+            [
+                hashlib.sha256(str(i).encode()).hexdigest()
+                for i in range(num_observables)
+            ],
+            name="observable_id",
+        ),
+    )
+
+
+def time_observables_cycles(num_observables: int, bulk: bool, cycles: int) -> list:
+    """Return durations (in seconds) of a first cycle (all observables are new)
+    and of following cycles (all observables are updated)."""
+    durations = []
+    with transaction.atomic():
+        for cycle in range(cycles):
+            observables_df = make_observables_df(
+                num_observables,
+                aileen_now()
+                + timedelta(seconds=cycle * settings.SENSOR_LOG_INTERVAL_IN_SECONDS),
+            )
+            start_time = time.time()
+            Observables.save_from_df(observables_df, bulk=bulk)
+            durations.append(time.time() - start_time)
+        transaction.set_rollback(True)
+    return durations
+
+
+class Command(BaseCommand):
+    help = "Benchmark the time it takes to write the observables of one sensor reading to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[1000, 10000, 100000],
+            help="Numbers of observables per sensor reading.",
+        )
+        parser.add_argument(
+            "--cycles",
+            type=int,
+            default=3,
+            help="Cycles per size. The first one creates all observables, the others update them.",
+        )
+        parser.add_argument(
+            "--skip-row-by-row",
+            action="store_true",
+            help="Only measure the bulk mode (row by row takes long for large sizes).",
+        )
+
+    def handle(self, *args, **options):
+        modes = [True] if options["skip_row_by_row"] else [False, True]
+        for num_observables in options["sizes"]:
+            for bulk in modes:
+                durations = time_observables_cycles(
+                    num_observables, bulk, options["cycles"]
+                )
+                logger.info(
+                    "%d observables, %s: creating took %.2f s, updating took %.2f s on average."
+                    % (
+                        num_observables,
+                        "bulk" if bulk else "row by row",
+                        durations[0],
+                        sum(durations[1:]) / max(len(durations) - 1, 1),
+                    )
+                )
@@ -0,0 +1,97 @@
+import logging
+import re
+import sys
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from box.management.commands.aggregate_data import get_unaggregated_hours
+from box.models import BoxSettings, OutboxEntry
+from box.utils.outbox import read_outbox
+from data.models import Events, SeenByHour, TmuxStatus
+from data.queries import count_unique_observables_seen, get_unique_observable_ids_seen
+from data.time_utils import aileen_now
+
+"""
+Check that the hot queries of the box use indexes, by letting SQLite explain their query plans.
+Exits with an error if any of them scans a whole table (of the ones we check), so this can guard against regressions.
+"""
+
+logger = logging.getLogger(__name__)
+
+CHECKED_TABLES = (
+    Events._meta.db_table,
+    SeenByHour._meta.db_table,
+    TmuxStatus._meta.db_table,
+    OutboxEntry._meta.db_table,
+)
+
+# e.g. "SCAN data_events" or (older SQLite versions) "SCAN TABLE data_events USING COVERING INDEX ..."
+FULL_SCAN_PATTERN = re.compile(r"^SCAN (TABLE )?(?P<table>\w+)")
+
+
+def run_hot_queries(box_id: str):
+    """Run the queries of the hot paths, like the recorder, aggregator and uploader do."""
+    now = aileen_now()
+    hour_ago = now - timedelta(hours=1)
+    get_unique_observable_ids_seen(box_id, hour_ago, now)
+    count_unique_observables_seen(
+        box_id,
+        hour_ago,
+        now,
+        also_seen_between=[(hour_ago - timedelta(hours=1), hour_ago)],
+    )
+    # as in upload_latest_events and upload_latest_aggregations
+    for kinds in (["events"], ["seen_by_hour", "seen_by_day"]):
+        _, rows = read_outbox(kinds, 100)
+        for kind_rows in rows.values():
+            list(kind_rows)
+    # this looks up SeenByHour by box and hour_start, and TmuxStatus by sensor_status and time_stamp
+    get_unaggregated_hours(now - timedelta(days=7), now)
+
+
+def find_full_scans(sql: str) -> list:
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+        plan = [row[-1] for row in cursor.fetchall()]
+    full_scans = []
+    for detail in plan:
+        match = FULL_SCAN_PATTERN.match(detail)
+        if match and match.group("table") in CHECKED_TABLES:
+            full_scans.append(detail)
+    return full_scans
+
+
+class Command(BaseCommand):
+    help = "Check that the hot queries use indexes (on SQLite), and fail if one of them scans a whole table."
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            logger.warning(
+                f"Query plans can only be checked on SQLite, not on {connection.vendor}."
+            )
+            return
+        box_settings = BoxSettings.objects.first()
+        if box_settings is None:
+            logger.error(
+                "No box settings found. Please create some in the admin panel."
+            )
+            sys.exit(1)
+        with CaptureQueriesContext(connection) as queries:
+            run_hot_queries(box_settings.box_id)
+
+        problems = 0
+        for query in queries.captured_queries:
+            if not query["sql"].startswith("SELECT"):
+                continue
+            for full_scan in find_full_scans(query["sql"]):
+                problems += 1
+                logger.error(f"{full_scan} in query: {query['sql']}")
+        if problems > 0:
+            logger.error(f"{problems} full table scan(s) found.")
+            sys.exit(1)
+        logger.info(
+            f"All {len(queries.captured_queries)} hot queries use indexes on the tables we check."
+        )
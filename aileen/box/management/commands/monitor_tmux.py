@@ -11,6 +11,7 @@ import libtmux
 from box.management.commands.run_box import start_sensor_in_tmux
 from box.models import BoxSettings
 from box.utils.dir_handling import build_tmp_dir_name
+from box.utils.outbox import append_to_outbox
 from data.models import TmuxStatus
 from data.time_utils import sleep_until_interval_is_complete
 
@@ -58,11 +59,12 @@ def monitor_tmux_windows(tmux_session):
             "The sensor seems to be off (process is sleeping and will try again) ..."
         )
 
-    TmuxStatus.objects.update_or_create(
+    tmux_status, _ = TmuxStatus.objects.update_or_create(
         box_id=box_id,
         sensor_status=status,
         time_stamp=timezone.localize(datetime.now()),
     )
+    append_to_outbox("tmux_status", [tmux_status.id])
 
 
 class Command(BaseCommand):
@@ -1,82 +1,64 @@
 import logging
 import time
-from datetime import datetime
 import importlib
 
-import numpy as np
 import pandas as pd
-import pytz
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.db.models import Max
 
 from box.models import BoxSettings
-from box.utils.dir_handling import get_sensor, build_tmp_dir_name
-from box.utils.privacy_utils import hash_observable_ids
+from box.utils.dir_handling import get_sensor, build_tmp_dir_name, read_sensor
+from box.utils.file_watching import SensorFileWatcher
+from box.utils.observable_cache import ObservableCache
+from box.utils.outbox import append_new_events_to_outbox
+from box.utils.privacy_utils import HashMemo
+from box.utils.streaming_aggregation import StreamingAggregator
 from data.models import Events, Observables
+from data.queries import get_latest_events
 from data.time_utils import sleep_until_interval_is_complete
 
 logger = logging.getLogger(__name__)
 
 
-def update_database_with_new_and_updated_observables(sensor_events_df: pd.DataFrame):
+def update_database_with_new_and_updated_observables(
+    sensor_events_df: pd.DataFrame, observable_cache: ObservableCache = None
+) -> pd.DataFrame:
     """
     From known observables and latest sensor input, we compute what should go to the database:
 
     We are interested in the most recent events, which we do not yet know about.
-    There is some set computing involved to single these out.
+    We look up when we last saw each observable in the observable cache (if none is passed,
+    we make one from the database) and single these out.
 
     Based on this information, we also update the observables table (this includes adding new ones seen
     for the first time). Every observable gets time_last_seen set to what the sensor reported just now.
+
+    Returns the events which we wrote (indexed by observable_id).
     """
     logger.info(f"Length of sensor df: {len(sensor_events_df)}")
 
-    # Load a df of observables, with a compatible timezone
-    known_observables_df = Observables.to_df()
-    if len(known_observables_df.index) > 0:
-        known_observables_df.time_last_seen = known_observables_df.time_last_seen.dt.tz_convert(
-            settings.TIME_ZONE
-        )
-
-    # Create a dataframe of observables which were just discovered for the first time
-    new_observables_events_df = sensor_events_df[
-        ~sensor_events_df.observable_id.isin(known_observables_df.index)
-    ]
-
-    # Append the new observables to the known ones, as well
-    known_observables_df = known_observables_df.append(
-        new_observables_events_df[["observable_id", "time_seen"]]
-        .rename(columns={"time_seen": "time_last_seen"})
-        .set_index("observable_id"),
-        sort=False,
-    )
-
-    # Join the events which the sensor just recorded with information about known observables.
-    # The joined df has both time_seen and time_last_seen.
-    old_dt = datetime(1970, 1, 1, 1, 1, 1, tzinfo=pytz.timezone(settings.TIME_ZONE))
-    events_plus_observable_data_df = (
-        sensor_events_df.set_index("observable_id")
-        .join(known_observables_df)
-        .replace(np.NaN, old_dt)
-    )
+    if observable_cache is None:
+        observable_cache = ObservableCache()
+        observable_cache.warm()
 
     # Now we can distill which updated events actually matter to us
     # (sensors might report already known events to us):
-    # the ones where last_seen > time_last_seen. This excludes both old entries in the sensor data, where both
-    # time_seen and time_last_seen are longer ago and new observables, which have both time_seen and time_last_seen
-    # set to just now. Thus, we add the latter here.
-    updated_events_df = (
-        events_plus_observable_data_df[
-            events_plus_observable_data_df.time_seen
-            > events_plus_observable_data_df.time_last_seen
-        ]
-        .drop(columns=["time_last_seen"])
-        .append(new_observables_events_df.set_index("observable_id"))
-    )
+    # the ones of observables we see for the first time, and the ones where time_seen is after the time we last
+    # saw the observable. This excludes old entries in the sensor data.
+    updated_events_df = sensor_events_df[
+        observable_cache.is_new_or_updated(sensor_events_df)
+    ].set_index("observable_id")
 
-    # do custom value adjustments if wanted
+    # do custom value adjustments if wanted - preferably for all events at once
     sensor = get_sensor()
-    if hasattr(sensor, "adjust_event_value"):
+    if hasattr(sensor, "adjust_event_values"):
+        last_events_df = get_latest_events(updated_events_df.index.unique())
+        updated_events_df = sensor.adjust_event_values(
+            updated_events_df, last_events_df
+        )
+    elif hasattr(sensor, "adjust_event_value"):
 
         def adjust_event(event_df):
             observable: Observables = Observables.find_observable_by_id(
@@ -108,7 +90,9 @@ def update_database_with_new_and_updated_observables(sensor_events_df: pd.DataFr
     # And now it is time to let the database know about all of this.
     # First the observables, then events, so that the FK relation from events to observables works.
     with transaction.atomic():
-        created = Observables.save_from_df(observables_with_recent_updates_df)
+        created = Observables.save_from_df(
+            observables_with_recent_updates_df, bulk=settings.BULK_DB_WRITES
+        )
         logger.info(
             f"Finished saving {len(observables_with_recent_updates_df.index)} observables, {created} were new."
         )
@@ -118,39 +102,94 @@ def update_database_with_new_and_updated_observables(sensor_events_df: pd.DataFr
             raise Exception(
                 "No box settings yet. Please create some in the admin panel."
             )
-        created = Events.save_from_df(updated_events_df, box_settings.box_id)
+        # new events get higher IDs than the ones we have, so we can put them into the outbox in one go
+        max_event_id_before = Events.objects.aggregate(Max("id"))["id__max"]
+        created = Events.save_from_df(
+            updated_events_df, box_settings.box_id, bulk=settings.BULK_DB_WRITES
+        )
+        append_new_events_to_outbox(box_settings.box_id, max_event_id_before)
         logger.info(
             f"Finished saving {len(updated_events_df.index)} updated observable events, {created} were new."
         )
 
+    observable_cache.update(observables_with_recent_updates_df)
+    # the sensor might report these sightings again, so we keep them in the cache
+    observable_cache.evict(keep_since=sensor_events_df["time_seen"].min())
+
+    return updated_events_df
+
+
+def wait_for_next_reading(
+    start_time: float, sensor_file_watcher: SensorFileWatcher = None
+):
+    """Wait until the sensor wrote new data (if we watch its files) or until the log interval is complete."""
+    if sensor_file_watcher is not None:
+        sensor_file_watcher.wait_for_changes()
+    else:
+        sleep_until_interval_is_complete(
+            start_time, settings.SENSOR_LOG_INTERVAL_IN_SECONDS
+        )
+
+
+def save_sensor_reading_cursor(box_settings: BoxSettings, cursor, new_cursor):
+    """Remember how far we read the sensor (also when the read brought no new rows). Returns the cursor to use next."""
+    if new_cursor != cursor and box_settings is not None:
+        BoxSettings.objects.filter(id=box_settings.id).update(
+            sensor_reading_cursor=new_cursor
+        )
+    return new_cursor
+
 
 def sensor_data_to_db(tmp_path: str):
     logger.info(f"{settings.TERM_LBL} Starting to transfer the sensor input to db ...")
     sensor = get_sensor()
+    observable_cache = ObservableCache()
+    observable_cache.warm()
+    hash_memo = HashMemo()
+    # if the sensor can read incrementally, we continue where we (or a previous recorder process) left off
+    box_settings = BoxSettings.objects.first()
+    cursor = box_settings.sensor_reading_cursor if box_settings is not None else None
+    sensor_file_watcher = None
+    if settings.SENSOR_WATCH_FILES:
+        sensor_file_watcher = SensorFileWatcher(tmp_path)
+    streaming_aggregator = None
+    if settings.INCREMENTAL_AGGREGATION and box_settings is not None:
+        streaming_aggregator = StreamingAggregator(box_settings.box_id)
 
     while True:
         start_time = time.time()
-        sensor_data_df = sensor.get_latest_reading_as_df(tmp_path)
+        sensor_data_df, new_cursor = read_sensor(sensor, tmp_path, cursor)
+        if len(sensor_data_df.index) == 0:
+            logger.info("No new sensor data.")
+            cursor = save_sensor_reading_cursor(box_settings, cursor, new_cursor)
+            wait_for_next_reading(start_time, sensor_file_watcher)
+            continue
 
         # check if expected columns are given
         for expected_column in ("observable_id", "time_seen", "value", "observations"):
             if expected_column not in sensor_data_df.columns:
                 logger.error(
-                    "The sensor module function 'get_latest_reading_as_df' did not return a dataframe"
+                    "The sensor module did not return a dataframe"
                     " with the column %s."
                     " Instead, the dataframe only has these columns: %s",
                     expected_column, sensor_data_df.columns
                 )
 
-        # hash observable IDs if wanted
-        sensor_data_df["observable_id"] = sensor_data_df["observable_id"].map(
-            lambda x: hash_observable_ids(str(x))
-        )
+        # hash observable IDs if wanted (each distinct ID once, and the memo knows most of them already)
+        raw_observable_ids = sensor_data_df["observable_id"].astype(str)
+        hashed_observable_ids = hash_memo.hash_many(raw_observable_ids.unique())
+        sensor_data_df["observable_id"] = raw_observable_ids.map(hashed_observable_ids)
+        if settings.HASH_OBSERVABLE_IDS:
+            logger.info(f"Hashing observable IDs: {hash_memo.stats}.")
 
-        update_database_with_new_and_updated_observables(sensor_data_df)
-        sleep_until_interval_is_complete(
-            start_time, settings.SENSOR_LOG_INTERVAL_IN_SECONDS
+        updated_events_df = update_database_with_new_and_updated_observables(
+            sensor_data_df, observable_cache
         )
+        if streaming_aggregator is not None:
+            streaming_aggregator.add_events(updated_events_df)
+            streaming_aggregator.save()
+        cursor = save_sensor_reading_cursor(box_settings, cursor, new_cursor)
+        wait_for_next_reading(start_time, sensor_file_watcher)
 
         print()
 
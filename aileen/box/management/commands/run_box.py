@@ -117,6 +117,20 @@ def run_box(sudo_password: str = None):
         "%s Monitoring all of the running tmux sessions ..." % settings.TERM_LBL
     )
 
+    # now start to archive old events, if wanted
+    if settings.EVENTS_RETENTION_IN_DAYS > 0:
+        run_command_in_tmux(
+            tmux_session,
+            "%s %s manage.py archive_events --loop"
+            % (settings.ACTIVATE_VENV_CMD, sys.executable),
+            restart_after_n_seconds=3,
+            window_name="archive_events",
+        )
+        logger.info(
+            "%s Archiving events older than %d days ..."
+            % (settings.TERM_LBL, settings.EVENTS_RETENTION_IN_DAYS)
+        )
+
     # Starting the local dashboard server - needs sudo rights if the port is 80
     if int(settings.BOX_PORT) == 80:
         command = (
@@ -1,197 +1,473 @@
 import logging
 import time
+from typing import Callable, Dict, List, Optional, Tuple
 
 import pytz
 import requests
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.core.serializers import serialize
-
-from box.models import BoxSettings
-from data.models import Events, SeenByDay, SeenByHour, TmuxStatus, Observables
-from data.time_utils import (
-    as_day,
-    get_most_recent_hour,
-    get_timezone,
-    sleep_until_interval_is_complete,
+from django.db.models import F
+
+from box.models import BoxSettings, UploadChannelStatus
+from box.utils.outbox import acknowledge_outbox, count_outbox, read_outbox
+from box.utils.upload_batching import AdaptiveBatchSize
+from box.utils.upload_channels import UploadChannel, UploadPriorities
+from box.utils.upload_client import (
+    RETRY_STATUS_CODES,
+    UploadClient,
+    UploadFailed,
+    UploadRejected,
+)
+from box.utils.upload_spool import UploadSpool
+from data.models import Observables, SeenByHour
+from data.time_utils import aileen_now, get_most_recent_hour
+from data.wire_format import (
+    CONTENT_TYPE,
+    UPLOAD_FORMAT_HEADER,
+    UPLOAD_FORMATS_HEADER,
+    SKETCHES_UPLOAD_FORMAT,
+    WIRE_FORMAT_VERSION,
+    encode_events,
 )
 
 logger = logging.getLogger(__name__)
 
+# channels with a lower number go first (see UploadPriorities)
+UPLOAD_CHANNEL_PRIORITIES = dict(aggregations=0, tmux_status=1, events=2)
 
-def upload_latest_events():
-    """Check box settings, upload events and also affected observables."""
-    box_settings = BoxSettings.objects.first()
+# the server responds with this if a request is too big (other errors do not tell us anything about the size)
+TOO_LARGE_STATUS_CODES = (413,)
 
-    # get events which have an ID higher than the last uploaded one
-    events_query = Events.objects.filter(box_id=box_settings.box_id)
-    latest_event = box_settings.events_uploaded_until
-    if latest_event is not None:
-        events_query = events_query.filter(id__gt=latest_event.id)
-    events = events_query.order_by("id").all()[: settings.UPLOAD_MAX_NUMBER_PER_REQUEST]
-
-    # get queries for observables mentioned in these events and record the latest event
-    observable_queries = {}
-    new_latest_event = None  # cannot use events.last() as it doesn't understand slicing
-    for event in events:
-        observable_queries[event.observable_id] = Observables.objects.filter(
-            observable_id=event.observable_id
-        )
-        new_latest_event = event
+# servers before the distinction between invalid uploads (400) and their own errors (5xx)
+# responded with 400 to any error, so we send batches again after a 400, too
+RETRY_CLIENT_ERROR_STATUS_CODES = (400,)
 
-    if len(events) > 0:
-        logger.info(
-            f"I collected {len(events)} events to send, from {events.first().id} to {new_latest_event.id}."
-        )
-    else:
-        logger.info("No events found. Nothing to send.")
-        return
-    logger.info(f"I collected {len(observable_queries.keys())} observables to send.")
+# the kinds of outbox entries each channel uploads (see box/utils/outbox.py)
+AGGREGATION_KINDS = ["seen_by_hour", "seen_by_day"]
+
+# all uploads go through this client (one pooled session, with timeouts and retries)
+upload_client = UploadClient()
+
+# batches which could not be uploaded wait here (on disk) until they can
+upload_spool = UploadSpool()
+
+# the compact upload formats the server told us (in its last response) it understands
+server_upload_formats = set()
 
-    payload = dict(
-        observables=f"[{','.join(serialize('json', d)[1:-1] for d in observable_queries.values())}]",
-        events=serialize("json", events),
-    )
 
-    response = requests.post(
-        f"{box_settings.server_url}/api/postEvents/{box_settings.box_id}/",
-        data=payload,
-        headers={"Authorization": box_settings.upload_token},
+def remember_server_upload_formats(response: requests.Response):
+    global server_upload_formats
+    server_upload_formats = set(
+        version.strip()
+        for version in response.headers.get(UPLOAD_FORMATS_HEADER, "").split(",")
+        if version.strip() != ""
     )
 
+
+# sizes event batches across upload rounds
+event_batch_size = None
+
+
+def post_batch(
+    box_settings: BoxSettings,
+    channel: str,
+    batch: Dict,
+    upload_channel: UploadChannel = None,
+) -> requests.Response:
+    """Send a prepared batch (see prepare_events_batch). Returns the response if the server accepted it.
+    Raises UploadRejected if the server will not take it as it is, or UploadFailed if it might take it later
+    (we could not reach it, or it was overloaded or had an error).
+    If we upload in a channel, channels with a higher priority can go first."""
+    headers = dict(batch["headers"], Authorization=box_settings.upload_token)
+    if upload_channel is not None:
+        upload_channel.wait_for_higher_priorities()
+    response = upload_client.post(
+        f"{box_settings.server_url}{batch['path']}",
+        channel=channel,
+        data=batch["body"] if batch.get("body") is not None else batch["data"],
+        headers=headers,
+    )
+    remember_server_upload_formats(response)
     if response.status_code == 200:
+        return response
+    message = (
+        f"Server responded with code {response.status_code} ({response.text[:200]})."
+    )
+    if (
+        response.status_code in RETRY_STATUS_CODES
+        or response.status_code in RETRY_CLIENT_ERROR_STATUS_CODES
+        or response.status_code >= 500
+    ):
+        raise UploadFailed(message)
+    raise UploadRejected(message, response.status_code)
+
+
+def reject_batch(channel: str, num_items: int, path: Optional[str]):
+    """Note that the server rejected a batch, which we keep in the rejected batches of the spool (at path)
+    or, if it was not spooled, in the outbox."""
+    logger.error(
+        f"The server rejected {num_items} {channel} item(s), we keep them in {path}."
+        if path is not None
+        else f"The server rejected {num_items} {channel} item(s), we keep them in the outbox."
+    )
+    UploadChannelStatus.objects.get_or_create(channel=channel)
+    UploadChannelStatus.objects.filter(channel=channel).update(
+        rejected=F("rejected") + 1
+    )
+
+
+def upload_next_batch(
+    channel: str,
+    prepare: Callable[[BoxSettings], Optional[Dict]],
+    upload_channel: UploadChannel = None,
+    min_items: int = None,
+) -> Optional[Tuple[int, int, float]]:
+    """
+    Upload the next batch of a channel: the oldest one in the upload spool, if there is one,
+    or else a new one from the outbox (made by prepare).
+
+    If a new batch cannot be uploaded for now, we spool it (so it does not need to be prepared again)
+    and take its entries out of the outbox - unless the spool is full, then they stay in the outbox.
+    Spooled batches stay in the spool until the server accepts them, so they are uploaded in order.
+    If the server rejects a spooled batch, we put it with the rejected batches of the spool and move on, so one
+    batch the server will never take does not block its channel.
+    If the server rejects a new batch, its entries stay in the outbox, so it is prepared again next time
+    (with min_items given, a batch which the server rejects as too big is then prepared in smaller batches).
+
+    Only after the server accepted a batch, we move the channel's cursor (in BoxSettings).
+    Returns how many items we uploaded, in how many bytes and seconds - or None if there was nothing to upload.
+    Raises UploadFailed (or UploadRejected) if the upload failed.
+    """
+    box_settings = BoxSettings.objects.first()
+
+    spooled = upload_spool.batches(channel)
+    if len(spooled) > 0:
+        batch = upload_spool.read(spooled[0])
         logger.info(
-            f"Marking {new_latest_event.id} as the last Id successfully uploaded."
+            f"Sending {batch['num_items']} spooled {channel} item(s) ({len(spooled)} spooled batch(es) waiting)."
         )
-        box_settings.events_uploaded_until = new_latest_event
-        box_settings.save()
+        try:
+            response = post_batch(box_settings, channel, batch, upload_channel)
+        except UploadRejected:
+            reject_batch(channel, batch["num_items"], upload_spool.reject(spooled[0]))
+            raise
+        upload_spool.remove(spooled[0])
     else:
-        logger.error(
-            f"Server responded with code {response.status_code} ({response.text})."
+        batch = prepare(box_settings)
+        if batch is None:
+            return None
+        if batch["num_items"] == 0:  # these rows are gone, there is nothing to upload
+            acknowledge_outbox(batch["kinds"], batch["last_sequence_number"])
+            return 0, 0, 0
+        kinds, last_sequence_number = (
+            batch.pop("kinds"),
+            batch.pop("last_sequence_number"),
         )
+        try:
+            response = post_batch(box_settings, channel, batch, upload_channel)
+        except UploadRejected as e:
+            if (
+                min_items is not None
+                and batch["num_items"] > min_items
+                and e.status_code in TOO_LARGE_STATUS_CODES
+            ):
+                logger.warning(
+                    f"The server rejected {batch['num_items']} {channel} item(s), we will try smaller batches."
+                )
+            else:
+                reject_batch(channel, batch["num_items"], None)
+            raise
+        except UploadFailed:
+            if upload_spool.add(channel, batch, batch["num_items"]) is not None:
+                acknowledge_outbox(kinds, last_sequence_number)
+            raise
+        acknowledge_outbox(kinds, last_sequence_number)
+
+    move_cursor(box_settings, batch)
+    return batch["num_items"], batch["num_bytes"], response.elapsed.total_seconds()
+
+
+def move_cursor(box_settings: BoxSettings, batch: Dict):
+    if batch["cursor"]:
+        logger.info(f"Marking {batch['cursor']} as uploaded.")
+        # channels upload concurrently, so each only updates its own cursor
+        BoxSettings.objects.filter(id=box_settings.id).update(**batch["cursor"])
+
+
+def count_backlog(channel: str, kinds: List[str]) -> int:
+    return count_outbox(kinds) + upload_spool.count_items(channel)
+
+
+def prepare_events_batch(
+    box_settings: BoxSettings, batch_size: int = None
+) -> Optional[Dict]:
+    """Prepare a batch from the next events in the outbox and also affected observables."""
+    if batch_size is None:
+        batch_size = settings.UPLOAD_MAX_NUMBER_PER_REQUEST
+
+    # we load the batch of events once, and then use it for everything
+    last_sequence_number, rows = read_outbox(["events"], batch_size)
+    if last_sequence_number is None:
+        logger.info("No events found. Nothing to send.")
+        return None
+    batch = dict(
+        kinds=["events"], last_sequence_number=last_sequence_number, num_items=0
+    )
+    events = list(rows["events"].order_by("id"))
+    if len(events) == 0:
+        return batch
+    new_latest_event = events[-1]
+    logger.info(
+        f"I collected {len(events)} events to send, from {events[0].id} to {new_latest_event.id}."
+    )
 
-
-def upload_latest_aggregations():
-    """Upload latest aggregations."""
-    box_settings = BoxSettings.objects.first()
-    if box_settings.server_url is None or not box_settings.server_url.startswith(
-        "http"
+    # get the observables mentioned in these events, in one query
+    # (we select them by the events' id range, so we do not need a query parameter per observable)
+    observables = Observables.objects.filter(
+        events__box_id=box_settings.box_id,
+        events__id__gte=events[0].id,
+        events__id__lte=new_latest_event.id,
+    ).distinct()
+    logger.info(f"I collected {len(observables)} observables to send.")
+
+    batch.update(
+        path=f"/api/postEvents/{box_settings.box_id}/",
+        headers={},
+        body=None,
+        data=None,
+        cursor=dict(events_uploaded_until_id=new_latest_event.id),
+        num_items=len(events),
+    )
+    if (
+        settings.UPLOAD_COMPACT_EVENTS
+        and str(WIRE_FORMAT_VERSION) in server_upload_formats
     ):
-        logger.error(
-            "Server address %s not given or should start with 'http'!"
-            % box_settings.server_url
+        # older servers do not send the formats they support, so they get the old format
+        batch["body"] = encode_events(box_settings.box_id, events, observables)
+        batch["headers"] = {
+            "Content-Type": CONTENT_TYPE,
+            "Content-Encoding": "gzip",
+            UPLOAD_FORMAT_HEADER: str(WIRE_FORMAT_VERSION),
+        }
+        batch["num_bytes"] = len(batch["body"])
+        logger.info(f"Sending them in the compact format ({batch['num_bytes']} bytes).")
+    else:
+        batch["data"] = dict(
+            observables=serialize("json", observables), events=serialize("json", events)
+        )
+        batch["num_bytes"] = sum(
+            len(value.encode("utf-8")) for value in batch["data"].values()
         )
+    return batch
+
+
+def upload_latest_events(
+    batch_size: int = None, channel: UploadChannel = None
+) -> Optional[Tuple[int, int, float]]:
+    """Upload the next batch of events (see upload_next_batch)."""
+    return upload_next_batch(
+        "events",
+        lambda box_settings: prepare_events_batch(box_settings, batch_size),
+        channel,
+        min_items=event_batch_size.minimum if event_batch_size is not None else None,
+    )
 
-    # build queries
-    hour_query = SeenByHour.objects.filter(box_id=box_settings.box_id)
-    day_query = SeenByDay.objects.filter(box_id=box_settings.box_id)
-    latest_upload_time = box_settings.aggregations_uploaded_until
-    if latest_upload_time is not None:
-        hour_query = hour_query.filter(hour_start__gt=latest_upload_time)
-        day_query = day_query.filter(
-            day_start__gte=as_day(latest_upload_time.astimezone(get_timezone()))
+
+def save_channel_status(channel: str, uploaded: bool, **fields):
+    """Record how an upload channel is doing, together with the request statistics of the upload client."""
+    status, _ = UploadChannelStatus.objects.get_or_create(channel=channel)
+    for field, value in fields.items():
+        setattr(status, field, value)
+    client_stats = upload_client.stats.get(channel)
+    if client_stats is not None:
+        status.requests = client_stats["requests"]
+        status.retries = client_stats["retries"]
+        status.failures = client_stats["failures"]
+        status.latency = client_stats["latency"]
+    if uploaded:
+        status.last_upload_at = aileen_now()
+    status.updated_at = aileen_now()
+    status.save()
+
+
+def drain_event_backlog(deadline: float, channel: UploadChannel = None):
+    """
+    Upload event batches back to back, until the backlog is uploaded, the bandwidth budget
+    for this upload interval (AILEEN_UPLOAD_BUDGET_IN_BYTES_PER_INTERVAL) is spent, the deadline has passed
+    or an upload fails. Batches are sized from the ones we sent before (see AdaptiveBatchSize),
+    and smaller after an upload failed.
+    Spooled batches are sent first, as they were prepared.
+    Before each batch, we let channels with a higher priority go first.
+    Afterwards, we record the backlog and how fast we drained it (see UploadChannelStatus).
+    """
+    global event_batch_size
+    if event_batch_size is None:
+        event_batch_size = AdaptiveBatchSize()
+    budget = settings.UPLOAD_BUDGET_IN_BYTES_PER_INTERVAL
+    start_time = time.time()
+    events_sent, bytes_sent = 0, 0
+    while time.time() < deadline:
+        remaining_bytes = budget - bytes_sent if budget > 0 else None
+        if remaining_bytes is not None and remaining_bytes <= 0:
+            logger.info(f"Spent the upload budget of {budget} bytes for now.")
+            break
+        batch_size = event_batch_size.next_size(remaining_bytes)
+        try:
+            uploaded = upload_latest_events(batch_size, channel)
+        except UploadFailed as e:
+            logger.error(f"Could not upload events: {e}")
+            event_batch_size.shrink(
+                too_large=isinstance(e, UploadRejected)
+                and e.status_code in TOO_LARGE_STATUS_CODES
+            )
+            break
+        if uploaded is None:
+            break
+        num_events, num_bytes, request_duration = uploaded
+        event_batch_size.record(num_events, num_bytes, request_duration)
+        events_sent += num_events
+        bytes_sent += num_bytes
+
+    backlog = count_backlog("events", ["events"])
+    drain_rate = events_sent / max(time.time() - start_time, 0.001)
+    save_channel_status(
+        "events",
+        uploaded=events_sent > 0,
+        backlog=backlog,
+        drain_rate=drain_rate,
+        batch_size=event_batch_size.size,
+        bytes_sent=bytes_sent,
+    )
+    if events_sent > 0 or backlog > 0:
+        logger.info(
+            f"Uploaded {events_sent} events ({bytes_sent} bytes, {drain_rate:.1f} events/s),"
+            f" {backlog} are waiting."
         )
-    # query
-    seen_by_hour = hour_query.order_by("hour_start").all()[
-        : settings.UPLOAD_MAX_NUMBER_PER_REQUEST
-    ]
-    seen_by_day = day_query.order_by("day_start").all()[
-        : settings.UPLOAD_MAX_NUMBER_PER_REQUEST
-    ]
-
-    if len(seen_by_hour) == 0:
+
+
+def prepare_aggregations_batch(box_settings: BoxSettings) -> Optional[Dict]:
+    """Prepare a batch of the hours and days which were (re-)aggregated since we last uploaded."""
+    last_sequence_number, rows = read_outbox(
+        AGGREGATION_KINDS, settings.UPLOAD_MAX_NUMBER_PER_REQUEST
+    )
+    if last_sequence_number is None:
         logger.info("No aggregations found. Nothing to send.")
-        return
+        return None
+    seen_by_hour = list(rows["seen_by_hour"].order_by("hour_start"))
+    seen_by_day = list(rows["seen_by_day"].order_by("day_start"))
 
-    # find out until what aggregation time we won't upload again next time - current hour needs to stay out.
+    # remember until what time we uploaded finished hours - the current hour is not finished
     current_hour_start = get_most_recent_hour()
     latest_aggregation_time = None
     for aggregation in [
         sbh for sbh in seen_by_hour if sbh.hour_start < current_hour_start
     ]:
         latest_aggregation_time = aggregation.hour_start
+    if (
+        latest_aggregation_time is not None
+        and box_settings.aggregations_uploaded_until is not None
+    ):
+        latest_aggregation_time = max(
+            latest_aggregation_time, box_settings.aggregations_uploaded_until
+        )
 
     logger.info(
-        f"I collected {len(seen_by_hour)} hour aggregation(s) and {len(seen_by_day)} day aggregation(s) to send,"
-        f" starting at {seen_by_hour.first().hour_start}."
+        f"I collected {len(seen_by_hour)} hour aggregation(s) and {len(seen_by_day)} day aggregation(s) to send."
     )
-    if latest_aggregation_time is not None:
-        logger.info(
-            f" - next time I will not upload finished times up until {latest_aggregation_time}."
-        )
 
-    payload = dict(
-        seen_by_hour=serialize("json", seen_by_hour),
+    # servers which do not tell us they can save sketches would reject the unknown field
+    seen_by_hour_fields = None
+    if SKETCHES_UPLOAD_FORMAT not in server_upload_formats:
+        seen_by_hour_fields = [
+            field.name for field in SeenByHour._meta.fields if field.name != "sketch"
+        ]
+    data = dict(
+        seen_by_hour=serialize("json", seen_by_hour, fields=seen_by_hour_fields),
         seen_by_day=serialize("json", seen_by_day),
     )
-
-    response = requests.post(
-        f"{box_settings.server_url}/api/postAggregations/{box_settings.box_id}/",
-        data=payload,
-        headers={"Authorization": box_settings.upload_token},
+    return dict(
+        kinds=AGGREGATION_KINDS,
+        last_sequence_number=last_sequence_number,
+        path=f"/api/postAggregations/{box_settings.box_id}/",
+        headers={},
+        data=data,
+        # a batch can be spooled, so the cursor needs to be JSON
+        cursor=dict(aggregations_uploaded_until=latest_aggregation_time.isoformat())
+        if latest_aggregation_time is not None
+        else {},
+        num_items=len(seen_by_hour) + len(seen_by_day),
+        num_bytes=sum(len(value.encode("utf-8")) for value in data.values()),
     )
 
-    if response.status_code == 200:
-        if latest_aggregation_time is not None:
-            logger.info(
-                f"Marking {latest_aggregation_time} as the last aggregation time we will not upload next time."
-            )
-            box_settings.aggregations_uploaded_until = latest_aggregation_time
-            box_settings.save()
-    else:
-        logger.error(
-            f"Server responded with code {response.status_code} ({response.text})."
-        )
 
-
-def upload_tmux_status():
-    """upload the tmux_status"""
+def upload_latest_aggregations(channel: UploadChannel = None):
+    """Upload latest aggregations."""
     box_settings = BoxSettings.objects.first()
-
-    tmux_status_query = TmuxStatus.objects.filter(box_id=box_settings.box_id)
-    latest_status = box_settings.tmux_status_uploaded_until
-    if latest_status is not None:
-        tmux_status_query = tmux_status_query.filter(id__gt=latest_status.id)
-    statuss = tmux_status_query.order_by("id").all()[
-        : settings.UPLOAD_MAX_NUMBER_PER_REQUEST
-    ]
-
-    # get queries for tmux status mentioned in these tmux statuss' and record the latest tmux status
-    tmux_status_queries = {}
-    new_latest_status_query = None
-    for status in statuss:
-        tmux_status_queries[status.box_id] = TmuxStatus.objects.filter(
-            box_id=status.box_id
+    if box_settings.server_url is None or not box_settings.server_url.startswith(
+        "http"
+    ):
+        logger.error(
+            "Server address %s not given or should start with 'http'!"
+            % box_settings.server_url
         )
-        new_latest_status_query = status
-
-    if len(statuss) > 0:
-        logger.info(
-            f"I collected {len(statuss)} tmux status (of {len(tmux_status_queries.keys())} box)"
-            f" to send, from {statuss.first().id} to {new_latest_status_query.id}."
+    try:
+        uploaded = upload_next_batch(
+            "aggregations", prepare_aggregations_batch, channel
         )
-    else:
-        logger.info("No tmux status found. Nothing to send.")
-        return
+    except UploadFailed as e:
+        logger.error(f"Could not upload aggregations: {e}")
+        uploaded = None
+    save_channel_status(
+        "aggregations",
+        uploaded=uploaded is not None,
+        backlog=count_backlog("aggregations", AGGREGATION_KINDS),
+    )
 
-    payload = dict(tmux_statuss=serialize("json", statuss))
 
-    response = requests.post(
-        f"{box_settings.server_url}/api/postTmuxStatus/{box_settings.box_id}/",
-        data=payload,
-        headers={"Authorization": box_settings.upload_token},
+def prepare_tmux_status_batch(box_settings: BoxSettings) -> Optional[Dict]:
+    """Prepare a batch of the tmux statuses we did not upload yet."""
+    last_sequence_number, rows = read_outbox(
+        ["tmux_status"], settings.UPLOAD_MAX_NUMBER_PER_REQUEST
+    )
+    if last_sequence_number is None:
+        logger.info("No tmux status found. Nothing to send.")
+        return None
+    batch = dict(
+        kinds=["tmux_status"], last_sequence_number=last_sequence_number, num_items=0
+    )
+    statuss = list(rows["tmux_status"].order_by("id"))
+    if len(statuss) == 0:
+        return batch
+    new_latest_status_query = statuss[-1]
+    logger.info(
+        f"I collected {len(statuss)} tmux status to send, from {statuss[0].id} to {new_latest_status_query.id}."
     )
 
-    if response.status_code == 200:
-        logger.info(
-            f"Marking {new_latest_status_query.id} as the last status Id successfully uploaded."
-        )
-        box_settings.tmux_status_uploaded_until = new_latest_status_query
-        box_settings.save()
-    else:
-        logger.error(
-            f"Server responded with code {response.status_code} ({response.text})."
-        )
+    data = dict(tmux_statuss=serialize("json", statuss))
+    batch.update(
+        path=f"/api/postTmuxStatus/{box_settings.box_id}/",
+        headers={},
+        data=data,
+        cursor=dict(tmux_status_uploaded_until_id=new_latest_status_query.id),
+        num_items=len(statuss),
+        num_bytes=len(data["tmux_statuss"].encode("utf-8")),
+    )
+    return batch
+
+
+def upload_tmux_status(channel: UploadChannel = None):
+    """upload the tmux_status"""
+    try:
+        uploaded = upload_next_batch("tmux_status", prepare_tmux_status_batch, channel)
+    except UploadFailed as e:
+        logger.error(f"Could not upload tmux status: {e}")
+        uploaded = None
+    save_channel_status(
+        "tmux_status",
+        uploaded=uploaded is not None,
+        backlog=count_backlog("tmux_status", ["tmux_status"]),
+    )
 
 
 class Command(BaseCommand):
@@ -208,15 +484,26 @@ class Command(BaseCommand):
             f"{settings.TERM_LBL} Starting the uploader against {box_settings.server_url} ..."
         )
 
-        while True:
-            start_time = time.time()
-
-            if settings.UPLOAD_EVENTS is True:
-                upload_latest_events()
-            upload_latest_aggregations()
-            upload_tmux_status()
-            sleep_until_interval_is_complete(
-                start_time, settings.UPLOAD_INTERVAL_IN_SECONDS
+        priorities = UploadPriorities()
+        uploads = dict(
+            aggregations=upload_latest_aggregations, tmux_status=upload_tmux_status
+        )
+        if settings.UPLOAD_EVENTS is True:
+            uploads["events"] = lambda channel: drain_event_backlog(
+                deadline=time.time() + settings.UPLOAD_INTERVAL_IN_SECONDS,
+                channel=channel,
             )
-
-            print()
+        channels = [
+            UploadChannel(
+                name,
+                UPLOAD_CHANNEL_PRIORITIES[name],
+                upload,
+                priorities,
+                settings.UPLOAD_INTERVAL_IN_SECONDS,
+            )
+            for name, upload in uploads.items()
+        ]
+        for channel in channels:
+            channel.start()
+        for channel in channels:
+            channel.join()
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('box', '0003_auto_20190621_1621'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObservableIdHash',
+            fields=[
+                ('memo_key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('hashed_id', models.CharField(max_length=100)),
+                ('params_fingerprint', models.CharField(db_index=True, max_length=16)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:19
+from __future__ import unicode_literals
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('box', '0004_observableidhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boxsettings',
+            name='sensor_reading_cursor',
+            field=jsonfield.fields.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
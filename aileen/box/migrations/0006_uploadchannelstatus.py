@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('box', '0005_boxsettings_sensor_reading_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadChannelStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(max_length=32, unique=True)),
+                ('backlog', models.IntegerField(default=0)),
+                ('drain_rate', models.FloatField(default=0)),
+                ('batch_size', models.IntegerField(default=0)),
+                ('bytes_sent', models.BigIntegerField(default=0)),
+                ('last_upload_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Upload channel status',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('box', '0006_uploadchannelstatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadchannelstatus',
+            name='failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadchannelstatus',
+            name='latency',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadchannelstatus',
+            name='requests',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadchannelstatus',
+            name='retries',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:41
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def fill_outbox(apps, schema_editor):
+    """Put what was not uploaded yet (according to the upload cursors) into the outbox,
+    also if the box does not upload right now (it should catch up once it does).
+    We use SQL for the data tables, as this migration should not depend on the ones of the data app."""
+    box_settings = apps.get_model("box", "BoxSettings").objects.first()
+    if box_settings is None:
+        return
+    connection = schema_editor.connection
+    pending = dict(
+        seen_by_hour=("data_seenbyhour", "", []),
+        seen_by_day=("data_seenbyday", "", []),
+        tmux_status=("data_tmuxstatus", "", []),
+        events=("data_events", "", []),
+    )
+    if box_settings.events_uploaded_until_id is not None:
+        pending["events"] = ("data_events", " AND id > %s", [box_settings.events_uploaded_until_id])
+    if box_settings.aggregations_uploaded_until is not None:
+        uploaded_until = box_settings.aggregations_uploaded_until
+        pending["seen_by_hour"] = (
+            "data_seenbyhour", " AND hour_start > %s", [connection.ops.adapt_datetimefield_value(uploaded_until)]
+        )
+        pending["seen_by_day"] = (
+            "data_seenbyday",
+            " AND day_start > %s",
+            [connection.ops.adapt_datetimefield_value(uploaded_until - timedelta(days=1))],
+        )
+    if box_settings.tmux_status_uploaded_until_id is not None:
+        pending["tmux_status"] = ("data_tmuxstatus", " AND id > %s", [box_settings.tmux_status_uploaded_until_id])
+    with connection.cursor() as cursor:
+        for kind, (table, condition, params) in pending.items():
+            cursor.execute(
+                f"INSERT INTO box_outboxentry (kind, object_id) SELECT %s, id FROM {table}"
+                f" WHERE box_id = %s{condition} ORDER BY id",
+                [kind, box_settings.box_id] + params,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('box', '0007_uploadchannelstatus_requests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('object_id', models.BigIntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'Outbox entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxentry',
+            index=models.Index(fields=['kind', 'id'], name='outbox_kind_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxentry',
+            index=models.Index(fields=['kind', 'object_id'], name='outbox_kind_object_idx'),
+        ),
+        migrations.RunPython(fill_outbox, migrations.RunPython.noop),
+    ]
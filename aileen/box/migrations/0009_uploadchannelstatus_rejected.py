@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('box', '0008_outboxentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadchannelstatus',
+            name='rejected',
+            field=models.IntegerField(default=0),
+        ),
+    ]
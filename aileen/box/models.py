@@ -2,6 +2,7 @@ import uuid
 
 from django.core.exceptions import ValidationError
 from django.db import models
+from jsonfield import JSONField
 
 
 class BoxSettings(models.Model):
@@ -17,6 +18,8 @@ class BoxSettings(models.Model):
     tmux_status_uploaded_until = models.ForeignKey(
         "data.TmuxStatus", null=True, blank=True, on_delete=models.PROTECT
     )
+    # where the recorder left off reading the sensor (only for sensors which can read incrementally)
+    sensor_reading_cursor = JSONField(null=True, blank=True, editable=False)
 
     objects = models.Manager()
 
@@ -43,3 +46,70 @@ class BoxSettings(models.Model):
 
     def has_save_permission(self):
         return BoxSettings.objects.filter(id=self.id).exists()
+
+
+class ObservableIdHash(models.Model):
+    """Memo of hashed observable IDs, so the expensive hashing is done once per observable (see privacy_utils).
+    Only used with HASH_MEMO_ON_DISK. Raw IDs are not stored, rows are keyed by a keyed digest of the raw ID."""
+
+    memo_key = models.CharField(max_length=64, primary_key=True)
+    hashed_id = models.CharField(max_length=100)
+    # tells which SECRET_KEY and HASH_ITERATIONS were used, so we can drop outdated rows
+    params_fingerprint = models.CharField(max_length=16, db_index=True)
+
+    objects = models.Manager()
+
+    def __repr__(self):
+        return f"<ObservableIdHash {self.memo_key} -> {self.hashed_id}>"
+
+
+class UploadChannelStatus(models.Model):
+    """How the uploader is doing with one kind of data (e.g. events): how much is waiting to be uploaded,
+    and how fast we have been uploading it lately. Written by the uploader after each upload round."""
+
+    channel = models.CharField(max_length=32, unique=True)
+    backlog = models.IntegerField(default=0)
+    # items per second, over the last upload round
+    drain_rate = models.FloatField(default=0)
+    batch_size = models.IntegerField(default=0)
+    bytes_sent = models.BigIntegerField(default=0)
+    # requests (and their retries) which the uploader sent since it started, and how long the last one took
+    requests = models.IntegerField(default=0)
+    retries = models.IntegerField(default=0)
+    failures = models.IntegerField(default=0)
+    latency = models.FloatField(null=True, blank=True)
+    # batches the server rejected (see box/utils/upload_spool.py)
+    rejected = models.IntegerField(default=0)
+    last_upload_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    objects = models.Manager()
+
+    class Meta:
+        verbose_name_plural = "Upload channel status"
+
+    def __repr__(self):
+        return f"<UploadChannelStatus {self.channel}: {self.backlog} waiting, draining {self.drain_rate:.1f}/s>"
+
+
+class OutboxEntry(models.Model):
+    """A row which was created or modified on the box and still needs to be uploaded (see box/utils/outbox.py).
+    The id is the sequence number: the uploader reads entries in this order, and acknowledges them
+    (deletes them) up to a sequence number once the server has the rows."""
+
+    kind = models.CharField(max_length=32)
+    object_id = models.BigIntegerField()
+
+    objects = models.Manager()
+
+    class Meta:
+        verbose_name_plural = "Outbox entries"
+        indexes = [
+            # reading the outbox of a kind in order
+            models.Index(fields=["kind", "id"], name="outbox_kind_id_idx"),
+            # finding the entry of a row which changed again
+            models.Index(fields=["kind", "object_id"], name="outbox_kind_object_idx"),
+        ]
+
+    def __repr__(self):
+        return f"<OutboxEntry {self.id}: {self.kind} {self.object_id}>"
@@ -4,4 +4,7 @@ from box import views
 
 app_name = "box"
 
-urlpatterns = [url(r"^$", views.dashboard, name="dashboard")]
+urlpatterns = [
+    url(r"^$", views.dashboard, name="dashboard"),
+    url(r"^api/upload_status/", views.upload_status, name="upload_status"),
+]
@@ -2,7 +2,9 @@ import os
 import logging
 from tempfile import gettempdir
 import importlib
+from typing import Any, Tuple
 
+import pandas as pd
 from django.conf import settings
 
 
@@ -41,9 +43,24 @@ def get_sensor():
             "Need the start_sensing function to be available in %s."
             % settings.SENSOR_MODULE
         )
-    if not "get_latest_reading_as_df" in sensor.__dict__:
+    if (
+        "get_latest_reading_as_df" not in sensor.__dict__
+        and "get_readings_since" not in sensor.__dict__
+    ):
         raise Exception(
-            "Need the get_latest_reading_as_df function to be available in %s."
+            "Need the get_latest_reading_as_df or get_readings_since function to be available in %s."
             % settings.SENSOR_MODULE
         )
     return sensor
+
+
+def read_sensor(sensor, tmp_path: str, cursor: Any = None) -> Tuple[pd.DataFrame, Any]:
+    """Get the sensor data we have not seen yet, and a cursor to pass next time.
+
+    If the sensor module implements get_readings_since(tmp_path, cursor), we prefer that, as it
+    only returns rows after the (opaque, JSON-serializable) cursor, together with a new cursor.
+    Otherwise, we read the whole latest reading with get_latest_reading_as_df(tmp_path) - no cursor then.
+    """
+    if "get_readings_since" in sensor.__dict__:
+        return sensor.get_readings_since(tmp_path, cursor)
+    return sensor.get_latest_reading_as_df(tmp_path), None
@@ -0,0 +1,64 @@
+import logging
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SensorFileWatcher:
+    """
+    Lets the recorder wait until the sensor wrote to its files (in the tmp dir, starting with SENSOR_FILE_PREFIX),
+    instead of waking up every SENSOR_LOG_INTERVAL_IN_SECONDS. This uses inotify, so it works on Linux only
+    and needs the inotify_simple package.
+
+    Sensors often write in bursts, so after the first change we wait until the files have been quiet for
+    the debounce period - but never longer than the maximal latency after that first change.
+    """
+
+    def __init__(
+        self,
+        tmp_path: str,
+        debounce_in_seconds: float = None,
+        max_latency_in_seconds: float = None,
+    ):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            raise Exception(
+                "Watching sensor files needs the inotify_simple package (pip install inotify_simple)."
+            )
+        if debounce_in_seconds is None:
+            debounce_in_seconds = settings.SENSOR_WATCH_DEBOUNCE_IN_SECONDS
+        if max_latency_in_seconds is None:
+            max_latency_in_seconds = settings.SENSOR_WATCH_MAX_LATENCY_IN_SECONDS
+        self.debounce_in_seconds = debounce_in_seconds
+        self.max_latency_in_seconds = max_latency_in_seconds
+        self.inotify = INotify()
+        self.inotify.add_watch(
+            tmp_path, flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO
+        )
+        logger.info(f"Watching {tmp_path} for changes to sensor files ...")
+
+    @staticmethod
+    def _concern_sensor_files(events) -> bool:
+        return any(
+            event.name.startswith(settings.SENSOR_FILE_PREFIX) for event in events
+        )
+
+    def wait_for_changes(self):
+        """Block until sensor files changed and the sensor is done writing (or the maximal latency is reached)."""
+        while not self._concern_sensor_files(self.inotify.read()):
+            pass
+        first_change = time.time()
+        while True:
+            remaining_seconds = self.max_latency_in_seconds - (
+                time.time() - first_change
+            )
+            if remaining_seconds <= 0:
+                return
+            events = self.inotify.read(
+                timeout=int(1000 * min(self.debounce_in_seconds, remaining_seconds))
+            )
+            if not self._concern_sensor_files(events):
+                return
@@ -0,0 +1,109 @@
+import logging
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from data.db_utils import in_batches
+from data.models import Observables
+from data.time_utils import aileen_now
+
+logger = logging.getLogger(__name__)
+
+
+class ObservableCache:
+    """
+    Remembers when we last saw each observable (observable_id -> time_last_seen, as naive UTC), so the recorder
+    does not need to read the Observables table in every cycle. It is warmed from the database once,
+    and then kept up to date with what the recorder writes.
+
+    To bound memory, observables not seen for the retention period are evicted (but never the ones in
+    the latest reading, as sensors keep reporting old sightings). Observables we do not know are looked up
+    in the database before we treat them as new, so an evicted observable does not look new when it shows up again.
+    """
+
+    def __init__(self, retention_in_seconds: int = None):
+        if retention_in_seconds is None:
+            retention_in_seconds = settings.OBSERVABLE_CACHE_RETENTION_IN_SECONDS
+        self.retention = timedelta(seconds=retention_in_seconds)
+        self.last_seen = self._as_series([], [])
+
+    def __len__(self):
+        return len(self.last_seen.index)
+
+    @staticmethod
+    def _as_utc(times) -> pd.DatetimeIndex:
+        """We keep naive UTC times, which are fast to compare (and pandas keeps their type in all operations)."""
+        if not isinstance(times, (pd.Series, pd.Index)):
+            times = list(times)
+        return pd.DatetimeIndex(pd.to_datetime(times, utc=True)).tz_localize(None)
+
+    def _as_series(self, observable_ids, times) -> pd.Series:
+        return pd.Series(
+            self._as_utc(times),
+            index=pd.Index(list(observable_ids), name="observable_id"),
+            name="time_last_seen",
+        )
+
+    def warm(self):
+        """Load all observables seen within the retention period from the database."""
+        recent_observables = list(
+            Observables.objects.filter(
+                time_last_seen__gte=aileen_now() - self.retention
+            ).values_list("observable_id", "time_last_seen")
+        )
+        self.last_seen = self._as_series(
+            [observable_id for observable_id, _ in recent_observables],
+            [time_last_seen for _, time_last_seen in recent_observables],
+        )
+        logger.info(f"Warmed the observable cache with {len(self)} observables.")
+
+    def load(self, observable_ids):
+        """Look up observables we do not know (e.g. evicted ones) in the database."""
+        unknown_ids = pd.Index(observable_ids).unique().difference(self.last_seen.index)
+        if len(unknown_ids) == 0:
+            return
+        known_observables = []
+        for batch in in_batches(unknown_ids):
+            known_observables.extend(
+                Observables.objects.filter(observable_id__in=batch).values_list(
+                    "observable_id", "time_last_seen"
+                )
+            )
+        if len(known_observables) > 0:
+            self.last_seen = self.last_seen.append(
+                self._as_series(
+                    [observable_id for observable_id, _ in known_observables],
+                    [time_last_seen for _, time_last_seen in known_observables],
+                )
+            )
+
+    def is_new_or_updated(self, events_df: pd.DataFrame) -> pd.Series:
+        """Tell for each event if its observable is unknown (also to the database) or if it was seen
+        after we last saw it."""
+        self.load(events_df.observable_id.values)
+        time_last_seen = self.last_seen.reindex(events_df.observable_id.values).values
+        time_seen = self._as_utc(events_df.time_seen).values
+        is_known = ~pd.isnull(time_last_seen)
+        is_updated = np.zeros(len(time_seen), dtype=bool)
+        is_updated[is_known] = time_seen[is_known] > time_last_seen[is_known]
+        return pd.Series(~is_known | is_updated, index=events_df.index)
+
+    def update(self, observables_df: pd.DataFrame):
+        """Remember the time_last_seen of observables (indexed by observable_id) we just wrote to the database."""
+        if len(observables_df.index) == 0:
+            return
+        updates = self._as_series(
+            observables_df.index, observables_df["time_last_seen"]
+        )
+        updates = updates.groupby(level=0).max()
+        self.last_seen = updates.combine_first(self.last_seen)
+
+    def evict(self, keep_since=None):
+        """Forget observables which we have not seen within the retention period.
+        If keep_since is given (e.g. the oldest time_seen in the latest reading), keep all seen since then."""
+        evict_before = self._as_utc([aileen_now() - self.retention])[0]
+        if keep_since is not None:
+            evict_before = min(evict_before, self._as_utc([keep_since])[0])
+        self.last_seen = self.last_seen[self.last_seen >= evict_before]
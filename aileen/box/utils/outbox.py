@@ -0,0 +1,104 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection
+from django.db.models import QuerySet
+
+from box.models import OutboxEntry
+from data.db_utils import in_batches
+from data.models import Events, SeenByDay, SeenByHour, TmuxStatus
+
+"""
+The outbox: a log of the rows which the box created or modified, and which still need to be uploaded.
+The recorder appends new events, the aggregator appends the hours and days it (re-)aggregated and
+the tmux monitor appends new statuses. The uploader reads the outbox in sequence, uploads the rows
+it refers to, and then acknowledges all entries up to the last sequence number it read, in one statement.
+
+A row which changes again before it was uploaded (like the current hour, which is re-aggregated often)
+has only one entry: its old entry is removed and a new one is appended, so it is uploaded once,
+in its latest state. If the uploader read the old entry already, the new one stays in the outbox,
+because its sequence number is higher than the ones acknowledged.
+
+Entries are appended also while nothing is uploaded (no internet connection, or events are not uploaded),
+as the uploader should catch up on these rows once uploading is turned on.
+
+We rely on sequence numbers being committed in order, which is the case on SQLite (one writer at a time).
+"""
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_MODELS = dict(
+    events=Events,
+    seen_by_hour=SeenByHour,
+    seen_by_day=SeenByDay,
+    tmux_status=TmuxStatus,
+)
+
+
+def remove_from_outbox(kind: str, object_ids: Iterable[int]):
+    """Remove the entries of these rows, e.g. because they were deleted."""
+    for batch in in_batches(list(object_ids)):
+        OutboxEntry.objects.filter(kind=kind).filter(object_id__in=batch).delete()
+
+
+def append_to_outbox(kind: str, object_ids: Iterable[int]):
+    """Note that these rows were created or modified. Entries for them which are still in the outbox are replaced."""
+    object_ids = list(object_ids)
+    remove_from_outbox(kind, object_ids)
+    OutboxEntry.objects.bulk_create(
+        [OutboxEntry(kind=kind, object_id=object_id) for object_id in object_ids]
+    )
+
+
+def append_new_events_to_outbox(box_id: str, after_id: Optional[int]) -> int:
+    """Append the events of the box with an ID higher than after_id (the ones we just inserted),
+    in one INSERT ... SELECT. Events are never modified, so there are no entries to replace.
+    Returns how many were appended."""
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {qn(OutboxEntry._meta.db_table)} (kind, object_id)"
+            f" SELECT %s, id FROM {qn(Events._meta.db_table)} WHERE box_id = %s AND id > %s ORDER BY id",
+            ["events", box_id, after_id or 0],
+        )
+        return cursor.rowcount
+
+
+def read_outbox(
+    kinds: List[str], limit: int
+) -> Tuple[Optional[int], Dict[str, QuerySet]]:
+    """Read up to limit entries of these kinds, in sequence. Returns the last sequence number we read
+    and, per kind, the rows the entries refer to (or None and no rows if the outbox is empty)."""
+    sequence_numbers = list(
+        OutboxEntry.objects.filter(kind__in=kinds)
+        .order_by("id")
+        .values_list("id", flat=True)[:limit]
+    )
+    if len(sequence_numbers) == 0:
+        return None, {}
+    last_sequence_number = sequence_numbers[-1]
+    return (
+        last_sequence_number,
+        {
+            kind: OUTBOX_MODELS[kind].objects.filter(
+                id__in=OutboxEntry.objects.filter(kind=kind)
+                .filter(id__lte=last_sequence_number)
+                .values("object_id")
+            )
+            for kind in kinds
+        },
+    )
+
+
+def acknowledge_outbox(kinds: List[str], until_sequence_number: int) -> int:
+    """The server has the rows of these entries, so we remove them. Returns how many were removed."""
+    deleted, _ = (
+        OutboxEntry.objects.filter(kind__in=kinds)
+        .filter(id__lte=until_sequence_number)
+        .delete()
+    )
+    return deleted
+
+
+def count_outbox(kinds: List[str]) -> int:
+    return OutboxEntry.objects.filter(kind__in=kinds).count()
@@ -1,7 +1,34 @@
 import binascii
 import hashlib
+import hmac
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable
 
 from django.conf import settings
+from django.db import connections
+
+from box.models import ObservableIdHash
+from data.db_utils import in_batches, insert_ignoring_conflicts
+
+logger = logging.getLogger(__name__)
+
+
+# Fewer IDs than this are hashed in-process, as handing them to the pool would not pay off
+MIN_IDS_FOR_HASHING_POOL = 4
+
+_hashing_pool = None
+_hashing_pool_processes = 0
+
+
+def _pbkdf2_hex(observable_id: str, salt: bytes, iterations: int) -> str:
+    hashed_id = hashlib.pbkdf2_hmac(
+        "sha256", observable_id.encode("utf-8"), salt, iterations
+    )
+    return binascii.hexlify(hashed_id).decode("ascii")
 
 
 def hash_observable_ids(observable_id: str) -> str:
@@ -9,12 +36,174 @@ def hash_observable_ids(observable_id: str) -> str:
     The sha256, with an app-specific salt and a high number of rounds."""
     if settings.HASH_OBSERVABLE_IDS is False:
         return observable_id
-    iterations = settings.HASH_ITERATIONS
-    hashed_id = hashlib.pbkdf2_hmac(
-        "sha256",
-        observable_id.encode("utf-8"),
-        settings.SECRET_KEY.encode(),
-        iterations,
+    return _pbkdf2_hex(
+        observable_id, settings.SECRET_KEY.encode(), settings.HASH_ITERATIONS
     )
-    hash_hex = binascii.hexlify(hashed_id).decode("ascii")
-    return hash_hex
+
+
+def get_hashing_pool() -> multiprocessing.pool.Pool:
+    """A pool of processes to hash with, sized to the number of CPU cores (or AILEEN_HASH_WORKERS).
+    It is started when first needed and then stays alive, so we do not pay for starting processes in every cycle."""
+    global _hashing_pool, _hashing_pool_processes
+    if _hashing_pool is None:
+        processes = settings.HASH_WORKERS or os.cpu_count() or 1
+        logger.info(f"Starting a pool of {processes} processes for hashing ...")
+        # the forked processes should not share our database connections
+        if not any(connection.in_atomic_block for connection in connections.all()):
+            connections.close_all()
+        _hashing_pool = multiprocessing.Pool(processes)
+        _hashing_pool_processes = processes
+    return _hashing_pool
+
+
+def hash_observable_ids_in_batch(observable_ids: Iterable[str]) -> Dict[str, str]:
+    """Hash many observable IDs at once, e.g. when a crowd arrives or the sensor restarted.
+    Each distinct ID is hashed once. Larger batches are spread over the hashing pool.
+    Returns a mapping of raw IDs to hashed IDs."""
+    unique_ids = list(set(observable_ids))
+    if settings.HASH_OBSERVABLE_IDS is False:
+        return {observable_id: observable_id for observable_id in unique_ids}
+    if len(unique_ids) < MIN_IDS_FOR_HASHING_POOL or settings.HASH_WORKERS == 1:
+        hashed_ids = [
+            hash_observable_ids(observable_id) for observable_id in unique_ids
+        ]
+    else:
+        pool = get_hashing_pool()
+        salt = settings.SECRET_KEY.encode()
+        hashed_ids = pool.starmap(
+            _pbkdf2_hex,
+            [
+                (observable_id, salt, settings.HASH_ITERATIONS)
+                for observable_id in unique_ids
+            ],
+            # a few chunks per process, so they finish at about the same time
+            chunksize=max(1, len(unique_ids) // (4 * _hashing_pool_processes)),
+        )
+    return dict(zip(unique_ids, hashed_ids))
+
+
+class HashMemo:
+    """
+    Remembers hashed observable IDs, as hashing them is expensive on purpose and we see the same IDs over and over.
+    Recently used hashes are kept in memory (LRU). With HASH_MEMO_ON_DISK, all of them are also stored in the
+    database (so restarts stay warm).
+
+    Raw IDs are never stored. Rows are keyed by an HMAC of the raw ID, with a key derived from SECRET_KEY and
+    HASH_ITERATIONS. This HMAC is fast to compute, so with the database and SECRET_KEY one can check guesses of
+    raw IDs without the expensive hashing - which is why the database part is opt-in (see the Readme).
+    When SECRET_KEY or HASH_ITERATIONS change, rows made with the old settings are dropped,
+    and without HASH_MEMO_ON_DISK, all rows are dropped.
+    """
+
+    def __init__(self, max_size: int = None):
+        if max_size is None:
+            max_size = settings.HASH_MEMO_MAX_SIZE
+        self.max_size = max_size
+        self.recent_hashes = OrderedDict()  # memo key -> hashed ID
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        secret = settings.SECRET_KEY.encode()
+        self.memo_secret = hmac.new(
+            secret, f"memo:{settings.HASH_ITERATIONS}".encode(), hashlib.sha256
+        ).digest()
+        self.params_fingerprint = hmac.new(
+            secret, f"fingerprint:{settings.HASH_ITERATIONS}".encode(), hashlib.sha256
+        ).hexdigest()[:16]
+        self.on_disk = settings.HASH_MEMO_ON_DISK
+        if settings.HASH_OBSERVABLE_IDS:
+            self.drop_outdated()
+
+    @property
+    def stats(self) -> str:
+        return f"{self.memory_hits} memory hits, {self.db_hits} db hits, {self.misses} misses"
+
+    def memo_key(self, observable_id: str) -> str:
+        return hmac.new(
+            self.memo_secret, observable_id.encode("utf-8"), hashlib.sha256
+        ).hexdigest()
+
+    def drop_outdated(self):
+        """Delete stored hashes which were made with other settings than the current ones
+        (or all of them, if we should not store any)."""
+        if not self.on_disk:
+            if ObservableIdHash.objects.exists():
+                logger.info("HASH_MEMO_ON_DISK is off, dropping stored hashed IDs ...")
+                ObservableIdHash.objects.all().delete()
+            return
+        outdated = ObservableIdHash.objects.exclude(
+            params_fingerprint=self.params_fingerprint
+        )
+        if outdated.exists():
+            logger.info(
+                "SECRET_KEY or HASH_ITERATIONS changed, dropping outdated hashed IDs ..."
+            )
+            outdated.delete()
+
+    def invalidate(self):
+        """Forget all hashed IDs, in memory and in the database."""
+        self.recent_hashes.clear()
+        ObservableIdHash.objects.all().delete()
+
+    def _remember(self, memo_key: str, hashed_id: str):
+        self.recent_hashes[memo_key] = hashed_id
+        self.recent_hashes.move_to_end(memo_key)
+        while len(self.recent_hashes) > self.max_size:
+            self.recent_hashes.popitem(last=False)
+
+    def hash_many(self, observable_ids: Iterable[str]) -> Dict[str, str]:
+        """Map each of the (raw) observable IDs to its hashed version."""
+        if settings.HASH_OBSERVABLE_IDS is False:
+            return {observable_id: observable_id for observable_id in observable_ids}
+        memo_keys = {
+            observable_id: self.memo_key(observable_id)
+            for observable_id in set(observable_ids)
+        }
+
+        hashed_ids = {}
+        for observable_id, memo_key in memo_keys.items():
+            if memo_key in self.recent_hashes:
+                self.recent_hashes.move_to_end(memo_key)
+                hashed_ids[observable_id] = self.recent_hashes[memo_key]
+        self.memory_hits += len(hashed_ids)
+
+        not_in_memory = [oid for oid in memo_keys if oid not in hashed_ids]
+        stored_hashes = {}
+        if self.on_disk:
+            for batch in in_batches(not_in_memory):
+                stored_hashes.update(
+                    ObservableIdHash.objects.filter(
+                        memo_key__in=[memo_keys[oid] for oid in batch],
+                        params_fingerprint=self.params_fingerprint,
+                    ).values_list("memo_key", "hashed_id")
+                )
+        self.db_hits += len(stored_hashes)
+
+        computed_hashes = hash_observable_ids_in_batch(
+            [oid for oid in not_in_memory if memo_keys[oid] not in stored_hashes]
+        )
+        self.misses += len(computed_hashes)
+        if self.on_disk:
+            insert_ignoring_conflicts(
+                ObservableIdHash,
+                [
+                    ObservableIdHash(
+                        memo_key=memo_keys[observable_id],
+                        hashed_id=hashed_id,
+                        params_fingerprint=self.params_fingerprint,
+                    )
+                    for observable_id, hashed_id in computed_hashes.items()
+                ],
+            )
+        for observable_id, hashed_id in computed_hashes.items():
+            stored_hashes[memo_keys[observable_id]] = hashed_id
+
+        for observable_id in not_in_memory:
+            memo_key = memo_keys[observable_id]
+            hashed_ids[observable_id] = stored_hashes[memo_key]
+            self._remember(memo_key, stored_hashes[memo_key])
+
+        return hashed_ids
+
+    def hash(self, observable_id: str) -> str:
+        return self.hash_many([observable_id])[observable_id]
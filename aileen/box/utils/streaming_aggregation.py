@@ -0,0 +1,206 @@
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+
+import pandas as pd
+from django.conf import settings
+
+from box.utils.outbox import append_to_outbox
+from data.models import SeenByDay, SeenByHour
+from data.queries import get_unique_observable_ids_seen
+from data.sketches import HyperLogLog
+from data.time_utils import aileen_now, as_aileen_time, as_day, as_hour
+
+logger = logging.getLogger(__name__)
+
+
+class BucketSeries:
+    """
+    The sets of observables seen in the current and the preceding bucket (hour or day), and the sets of
+    the buckets they are compared with (e.g. the preceding one, or the one a week earlier).
+    For the open buckets, we count the observables seen in them, and how many of them were also seen in
+    each compared bucket. These counts are updated with each observable which is new to a set,
+    so keeping them up to date costs as much as the number of new events.
+
+    Like the aggregator, we consider a bucket to include its end (an event seen exactly at the start of
+    a bucket also counts for the one before).
+    """
+
+    def __init__(self, box_id: str, length: timedelta, compare_offsets: List[int]):
+        self.box_id = box_id
+        self.length = length
+        self.compare_offsets = compare_offsets
+        self.sets: Dict[datetime, Set[str]] = {}
+        self.counts: Dict[datetime, List[int]] = {}
+        self.changed: Set[datetime] = set()
+
+    def compared_starts(self, start: datetime) -> List[datetime]:
+        return [start - offset * self.length for offset in self.compare_offsets]
+
+    def _load(self, start: datetime) -> Set[str]:
+        if start not in self.sets:
+            self.sets[start] = set(
+                get_unique_observable_ids_seen(self.box_id, start, start + self.length)
+            )
+        return self.sets[start]
+
+    def open(self, starts: Iterable[datetime]):
+        """Make these the open buckets. Their sets (and the ones they are compared with) are loaded
+        from the database if we do not have them yet. Sets we do not need anymore are dropped."""
+        starts = list(starts)
+        needed = set(starts)
+        for start in starts:
+            needed.update(self.compared_starts(start))
+        for start in list(self.sets):
+            if start not in needed:
+                del self.sets[start]
+        for start in list(self.counts):
+            if start not in starts:
+                del self.counts[start]
+        for start in starts:
+            if start in self.counts:
+                continue
+            seen = self._load(start)
+            self.counts[start] = [len(seen)] + [
+                len(seen.intersection(self._load(compared_start)))
+                for compared_start in self.compared_starts(start)
+            ]
+            self.changed.add(start)
+
+    def reset(self):
+        """Forget all sets and counts, so they are loaded from the database again."""
+        self.sets.clear()
+        self.counts.clear()
+
+    def add(self, start: datetime, observable_ids: Iterable[str]):
+        """Add observables seen in the bucket starting at start (if we keep a set for it)."""
+        if start not in self.sets:
+            return
+        seen = self.sets[start]
+        for observable_id in observable_ids:
+            if observable_id in seen:
+                continue
+            seen.add(observable_id)
+            if start in self.counts:
+                counts = self.counts[start]
+                counts[0] += 1
+                for i, compared_start in enumerate(self.compared_starts(start)):
+                    if observable_id in self.sets[compared_start]:
+                        counts[i + 1] += 1
+                self.changed.add(start)
+            # this bucket might be compared with by open buckets
+            for open_start, counts in self.counts.items():
+                for i, compared_start in enumerate(self.compared_starts(open_start)):
+                    if (
+                        compared_start == start
+                        and observable_id in self.sets[open_start]
+                    ):
+                        counts[i + 1] += 1
+                        self.changed.add(open_start)
+
+    def pop_changes(self) -> List[Tuple[datetime, List[int]]]:
+        changes = [
+            (start, list(self.counts[start]))
+            for start in sorted(self.changed)
+            if start in self.counts
+        ]
+        self.changed.clear()
+        return changes
+
+
+class StreamingAggregator:
+    """
+    Keeps SeenByHour and SeenByDay of the current and preceding hour/day up to date, as the recorder writes events.
+    This way, the aggregator process does not need to recompute them from all their events over and over
+    (see AILEEN_INCREMENTAL_AGGREGATION).
+
+    Every AILEEN_AGGREGATION_RECONCILIATION_INTERVAL_IN_SECONDS, the sets are loaded from the database again,
+    which corrects any drift (e.g. events written by others).
+    Events of buckets before the preceding hour/day are ignored, they are rare and the next reconciliation sees them.
+    """
+
+    def __init__(self, box_id: str, reconciliation_interval_in_seconds: int = None):
+        if reconciliation_interval_in_seconds is None:
+            reconciliation_interval_in_seconds = (
+                settings.AGGREGATION_RECONCILIATION_INTERVAL_IN_SECONDS
+            )
+        self.box_id = box_id
+        self.reconciliation_interval_in_seconds = reconciliation_interval_in_seconds
+        self.hours = BucketSeries(box_id, timedelta(hours=1), [1])
+        self.days = BucketSeries(box_id, timedelta(days=1), [1, 7])
+        self.hour_sketches: Dict[datetime, HyperLogLog] = {}
+        self.last_reconciliation = None
+
+    def _open_buckets(self):
+        now = aileen_now()
+        if (
+            self.last_reconciliation is None
+            or time.time() - self.last_reconciliation
+            >= self.reconciliation_interval_in_seconds
+        ):
+            logger.info("Loading observables seen in recent hours and days ...")
+            self.hours.reset()
+            self.days.reset()
+            self.hour_sketches.clear()
+            self.last_reconciliation = time.time()
+        self.hours.open([as_hour(now) - timedelta(hours=1), as_hour(now)])
+        self.days.open([as_day(now) - timedelta(days=1), as_day(now)])
+        if settings.AGGREGATION_SKETCHES:
+            for hour_start in list(self.hour_sketches):
+                if hour_start not in self.hours.counts:
+                    del self.hour_sketches[hour_start]
+            for hour_start in self.hours.counts:
+                if hour_start not in self.hour_sketches:
+                    self.hour_sketches[hour_start] = HyperLogLog.from_observable_ids(
+                        self.hours.sets[hour_start]
+                    )
+
+    def add_events(self, events_df: pd.DataFrame):
+        """Count the events (indexed by observable_id, with time_seen) which the recorder just wrote."""
+        self._open_buckets()
+        for series, as_bucket in ((self.hours, as_hour), (self.days, as_day)):
+            ids_by_bucket = defaultdict(list)
+            for observable_id, time_seen in zip(
+                events_df.index, events_df["time_seen"]
+            ):
+                time_seen = as_aileen_time(pd.Timestamp(time_seen).to_pydatetime())
+                bucket_start = as_bucket(time_seen)
+                ids_by_bucket[bucket_start].append(observable_id)
+                if time_seen == bucket_start:
+                    ids_by_bucket[bucket_start - series.length].append(observable_id)
+            for bucket_start, observable_ids in ids_by_bucket.items():
+                series.add(bucket_start, observable_ids)
+                if series is self.hours and bucket_start in self.hour_sketches:
+                    self.hour_sketches[bucket_start].add_many(observable_ids)
+
+    def save(self):
+        """Write the counts of buckets which changed to the database (and note them in the outbox)."""
+        changed_hour_ids, changed_day_ids = [], []
+        for hour_start, (seen, seen_also_in_preceding_hour) in self.hours.pop_changes():
+            values = dict(
+                seen=seen, seen_also_in_preceding_hour=seen_also_in_preceding_hour
+            )
+            if hour_start in self.hour_sketches:
+                values["sketch"] = self.hour_sketches[hour_start].to_bytes()
+            seen_by_hour, _ = SeenByHour.objects.update_or_create(
+                box_id=self.box_id, hour_start=hour_start, defaults=values
+            )
+            changed_hour_ids.append(seen_by_hour.id)
+        for (
+            day_start,
+            (seen, seen_also_on_preceding_day, seen_also_a_week_earlier),
+        ) in self.days.pop_changes():
+            seen_by_day, _ = SeenByDay.objects.update_or_create(
+                box_id=self.box_id,
+                day_start=day_start,
+                defaults=dict(
+                    seen=seen,
+                    seen_also_on_preceding_day=seen_also_on_preceding_day,
+                    seen_also_a_week_earlier=seen_also_a_week_earlier,
+                ),
+            )
+            changed_day_ids.append(seen_by_day.id)
+        append_to_outbox("seen_by_hour", changed_hour_ids)
+        append_to_outbox("seen_by_day", changed_day_ids)
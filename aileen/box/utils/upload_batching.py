@@ -0,0 +1,75 @@
+import logging
+from typing import Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveBatchSize:
+    """
+    Sizes upload batches from what we measured for the last ones: a request should take about
+    target_seconds, so on a slow link we send smaller batches (which are less likely to time out),
+    and on a fast one bigger batches (which drain a backlog with fewer round trips).
+    The size changes by at most a factor of two per batch, so one odd round trip does not throw it off.
+    When an upload fails, we halve the size.
+
+    We also keep track of the bytes per item, so a batch stays below max_bytes (the server rejects bigger requests)
+    and can be made to fit into what is left of a bandwidth budget.
+    """
+
+    def __init__(
+        self,
+        initial: int = None,
+        minimum: int = None,
+        maximum: int = None,
+        target_seconds: float = None,
+        max_bytes: int = None,
+    ):
+        self.minimum = minimum or settings.UPLOAD_MIN_NUMBER_PER_REQUEST
+        self.maximum = maximum or settings.UPLOAD_MAX_EVENTS_PER_REQUEST
+        self.target_seconds = (
+            target_seconds or settings.UPLOAD_TARGET_REQUEST_DURATION_IN_SECONDS
+        )
+        self.max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES_PER_REQUEST
+        self.bytes_per_item: Optional[float] = None
+        self.size = self._clamp(initial or settings.UPLOAD_MAX_NUMBER_PER_REQUEST)
+
+    def _clamp(self, size: float) -> int:
+        maximum = self.maximum
+        if self.bytes_per_item is not None:
+            maximum = min(maximum, int(self.max_bytes / self.bytes_per_item))
+        return int(max(self.minimum, min(maximum, size)))
+
+    def next_size(self, remaining_bytes: int = None) -> int:
+        """The size of the next batch. If there is a byte budget left, the batch is made to fit into it."""
+        if remaining_bytes is None or self.bytes_per_item is None:
+            return self.size
+        return max(1, min(self.size, int(remaining_bytes / self.bytes_per_item)))
+
+    def shrink(self, too_large: bool = False):
+        """An upload failed (it might have been too big, or the link is struggling), so we send less next time.
+        If the server told us it was too large, we also do not let batches grow back to that size."""
+        self.size = self._clamp(self.size * 0.5)
+        if too_large and self.bytes_per_item is not None:
+            self.max_bytes = min(self.max_bytes, int(self.size * self.bytes_per_item))
+        logger.debug(f"An upload failed, next batch size is {self.size}.")
+
+    def record(self, num_items: int, num_bytes: int, seconds: float):
+        """Adjust to a batch we sent."""
+        if num_items == 0:
+            return
+        bytes_per_item = num_bytes / num_items
+        if self.bytes_per_item is None:
+            self.bytes_per_item = bytes_per_item
+        else:  # a moving average, payloads vary with the observations in them
+            self.bytes_per_item = 0.7 * self.bytes_per_item + 0.3 * bytes_per_item
+        # only full batches tell us how many items fit into the target time
+        if num_items >= self.size:
+            factor = self.target_seconds / max(seconds, 0.001)
+            self.size = self._clamp(self.size * max(0.5, min(2.0, factor)))
+        else:  # items might have become bigger, so we still keep the size below max_bytes
+            self.size = self._clamp(self.size)
+        logger.debug(
+            f"Sent {num_items} items ({num_bytes} bytes) in {seconds:.2f}s, next batch size is {self.size}."
+        )
@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable
+
+from django.db import close_old_connections
+
+from data.time_utils import sleep_until_interval_is_complete
+
+logger = logging.getLogger(__name__)
+
+
+class UploadPriorities:
+    """
+    Lets upload channels with a higher priority (a lower number) go first: while one of them is uploading,
+    channels with a lower priority wait before sending their next request.
+    Requests which are on their way are not interrupted, so a higher-priority channel waits
+    for at most one request of a lower-priority one (e.g. one batch of events).
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.uploading_by_priority = Counter()
+
+    @contextmanager
+    def uploading(self, priority: int):
+        with self.condition:
+            self.uploading_by_priority[priority] += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.uploading_by_priority[priority] -= 1
+                self.condition.notify_all()
+
+    def wait_for_higher_priorities(self, priority: int, timeout: float = None) -> bool:
+        """Wait until no channel with a higher priority is uploading. Returns False if we timed out."""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not any(
+                    count > 0
+                    for other_priority, count in self.uploading_by_priority.items()
+                    if other_priority < priority
+                ),
+                timeout,
+            )
+
+
+class UploadChannel(threading.Thread):
+    """
+    Uploads one kind of data (e.g. aggregations) in its own thread, every interval_in_seconds.
+    Each channel keeps its own cursor (in BoxSettings), so channels do not wait for each other,
+    unless one with a higher priority is uploading (see UploadPriorities).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        priority: int,
+        upload: Callable[["UploadChannel"], None],
+        priorities: UploadPriorities,
+        interval_in_seconds: int,
+    ):
+        super().__init__(name=f"upload-{name}", daemon=True)
+        self.channel = name
+        self.priority = priority
+        self.upload = upload
+        self.priorities = priorities
+        self.interval_in_seconds = interval_in_seconds
+
+    def wait_for_higher_priorities(self):
+        """Call this before each request of a long upload, so more important channels can go first."""
+        if not self.priorities.wait_for_higher_priorities(self.priority, timeout=0):
+            logger.debug(f"Letting higher-priority uploads go before {self.channel}.")
+            self.priorities.wait_for_higher_priorities(self.priority)
+
+    def run(self):
+        while True:
+            start_time = time.time()
+            try:
+                self.wait_for_higher_priorities()
+                with self.priorities.uploading(self.priority):
+                    self.upload(self)
+            except Exception as e:
+                logger.exception(f"Uploading {self.channel} failed: {e}")
+            finally:
+                # each thread has its own database connection, which should not go stale while we sleep
+                close_old_connections()
+            sleep_until_interval_is_complete(start_time, self.interval_in_seconds)
@@ -0,0 +1,162 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# we retry on these, as well as on connection errors and timeouts
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+class UploadFailed(Exception):
+    pass
+
+
+class CircuitOpen(UploadFailed):
+    pass
+
+
+class UploadRejected(UploadFailed):
+    """The server answered, but will not take the upload as it is (a 4xx response other than 400 and 429).
+    Sending it again as it is would not help."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadClient:
+    """
+    The HTTP client of the uploader. All uploads share one session, so connections to the server
+    are kept alive and reused (saving a TCP and TLS handshake per request), and each request has
+    connect and read timeouts, so a hung connection cannot stall the uploader.
+
+    Failed requests (connection errors, timeouts and overload responses) are retried with exponential backoff,
+    with full jitter, so boxes which lost their connection at the same time do not all retry at once.
+    If requests keep failing after their retries, the circuit breaker opens: we stop sending requests
+    for a while, and then let one through to find out if the server is back.
+    The receiving endpoints save by primary key, so sending something twice does no harm.
+
+    Per channel (e.g. "events"), we count requests and retries and remember the latency of the last request.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = None,
+        read_timeout: float = None,
+        max_retries: int = None,
+        backoff_base: float = None,
+        backoff_max: float = None,
+        failure_threshold: int = None,
+        reset_timeout: float = None,
+    ):
+        self.timeout = (
+            connect_timeout or settings.UPLOAD_CONNECT_TIMEOUT_IN_SECONDS,
+            read_timeout or settings.UPLOAD_READ_TIMEOUT_IN_SECONDS,
+        )
+        self.max_retries = (
+            max_retries if max_retries is not None else settings.UPLOAD_MAX_RETRIES
+        )
+        self.backoff_base = backoff_base or settings.UPLOAD_BACKOFF_BASE_IN_SECONDS
+        self.backoff_max = backoff_max or settings.UPLOAD_BACKOFF_MAX_IN_SECONDS
+        self.failure_threshold = (
+            failure_threshold or settings.UPLOAD_CIRCUIT_BREAKER_THRESHOLD
+        )
+        self.reset_timeout = (
+            reset_timeout or settings.UPLOAD_CIRCUIT_BREAKER_RESET_IN_SECONDS
+        )
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = None
+        self.stats: Dict[str, Dict] = {}
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        )
+
+    def check_circuit(self):
+        with self.lock:
+            if self.open_until is None:
+                return
+            if time.time() < self.open_until:
+                raise CircuitOpen(
+                    f"Not uploading for another {self.open_until - time.time():.0f}s,"
+                    f" after {self.consecutive_failures} failed requests."
+                )
+            # half-open: we let this request through, if it fails we open the circuit again right away
+            self.open_until = None
+
+    def record(
+        self, channel: str, succeeded: bool, retries: int, latency: float = None
+    ):
+        with self.lock:
+            stats = self.stats.setdefault(
+                channel, dict(requests=0, retries=0, failures=0, latency=None)
+            )
+            stats["requests"] += 1
+            stats["retries"] += retries
+            if latency is not None:
+                stats["latency"] = latency
+            if succeeded:
+                self.consecutive_failures = 0
+                return
+            stats["failures"] += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.open_until = time.time() + self.reset_timeout
+                logger.warning(
+                    f"{self.consecutive_failures} uploads failed in a row,"
+                    f" pausing uploads for {self.reset_timeout}s."
+                )
+
+    def post(self, url: str, channel: str, **kwargs) -> requests.Response:
+        """Post (with retries). Returns the last response we got, or raises UploadFailed if we got none."""
+        self.check_circuit()
+        response, error = None, None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                delay = self.backoff(attempt - 1)
+                logger.info(
+                    f"Retrying the upload in {delay:.1f}s (attempt {attempt + 1})."
+                )
+                time.sleep(delay)
+            try:
+                response = self.session.post(url, timeout=self.timeout, **kwargs)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+                logger.warning(f"Upload to {url} failed: {e}")
+                continue
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+            logger.warning(f"Server responded with code {response.status_code}.")
+
+        latency = (
+            response.elapsed.total_seconds()
+            if response is not None and response.elapsed is not None
+            else None
+        )
+        self.record(
+            channel,
+            succeeded=response is not None
+            and response.status_code < 500
+            and response.status_code not in RETRY_STATUS_CODES,
+            retries=attempt,
+            latency=latency,
+        )
+        if response is None:
+            raise UploadFailed(str(error))
+        return response
@@ -0,0 +1,133 @@
+import base64
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Match, Optional
+
+from django.conf import settings
+
+"""
+The upload spool: a directory of upload batches which we prepared, but could not upload
+(because the server or our connection is down). Each batch is one gzip-compressed file, which holds
+what we need to send it again - so a spooled batch is never read from the database or serialized twice.
+Files are written atomically and synced to disk, so the spool survives reboots.
+
+Spooled batches of a channel are uploaded in the order they were spooled, before any new batch.
+Only batches which might go through later are spooled (the server could not be reached, was overloaded
+or had an error). Spooled batches which the server rejected are moved to the rejected/ sub-directory,
+so they do not block their channel, but can still be looked into (or sent again by hand).
+The spool (including rejected batches) has a size cap (AILEEN_UPLOAD_SPOOL_MAX_SIZE_IN_MB).
+When it is full, batches stay in the outbox (see box/utils/outbox.py) and will be prepared again later.
+"""
+
+logger = logging.getLogger(__name__)
+
+# e.g. events-00000042-500.json.gz (the 42nd batch of events, with 500 events in it)
+SPOOL_FILE_PATTERN = re.compile(
+    r"^(?P<channel>[a-z_]+)-(?P<number>\d+)-(?P<num_items>\d+)\.json\.gz$"
+)
+
+
+class UploadSpool:
+    def __init__(self, directory: str = None, max_size_in_bytes: int = None):
+        self.directory = directory or settings.UPLOAD_SPOOL_DIR
+        self.rejected_directory = os.path.join(self.directory, "rejected")
+        if max_size_in_bytes is None:
+            max_size_in_bytes = settings.UPLOAD_SPOOL_MAX_SIZE_IN_MB * 1024 * 1024
+        self.max_size_in_bytes = max_size_in_bytes
+        # channels spool from their own threads
+        self.lock = threading.Lock()
+
+    def _files(self, directory: str = None) -> List[Match]:
+        directory = directory or self.directory
+        if not os.path.isdir(directory):
+            return []
+        matches = [
+            SPOOL_FILE_PATTERN.match(file_name) for file_name in os.listdir(directory)
+        ]
+        return sorted(
+            (match for match in matches if match is not None),
+            key=lambda match: int(match.group("number")),
+        )
+
+    def size(self) -> int:
+        return sum(
+            os.path.getsize(os.path.join(directory, match.string))
+            for directory in (self.directory, self.rejected_directory)
+            for match in self._files(directory)
+        )
+
+    def batches(self, channel: str) -> List[str]:
+        """The paths of the spooled batches of the channel, oldest first."""
+        return [
+            os.path.join(self.directory, match.string)
+            for match in self._files()
+            if match.group("channel") == channel
+        ]
+
+    def count_items(self, channel: str) -> int:
+        return sum(
+            int(match.group("num_items"))
+            for match in self._files()
+            if match.group("channel") == channel
+        )
+
+    def add(self, channel: str, batch: Dict, num_items: int) -> Optional[str]:
+        """Write the batch to the spool. Returns its path, or None if the spool is full.
+        A body in bytes (as in the compact upload format) is kept as such."""
+        batch = dict(batch)
+        if isinstance(batch.get("body"), bytes):
+            batch["body"] = base64.b64encode(batch["body"]).decode("ascii")
+            batch["body_is_bytes"] = True
+        content = gzip.compress(json.dumps(batch).encode("utf-8"))
+        with self.lock:
+            if self.size() + len(content) > self.max_size_in_bytes:
+                logger.warning(
+                    f"The upload spool is full ({self.max_size_in_bytes} bytes), not spooling this batch."
+                )
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            # numbers are unique across both directories, so a rejected batch keeps its file name
+            number = 1 + max(
+                [
+                    int(match.group("number"))
+                    for match in self._files() + self._files(self.rejected_directory)
+                ],
+                default=0,
+            )
+            path = os.path.join(
+                self.directory, f"{channel}-{number:08d}-{num_items}.json.gz"
+            )
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as spool_file:
+                spool_file.write(content)
+                spool_file.flush()
+                os.fsync(spool_file.fileno())
+            os.replace(tmp_path, path)
+        logger.info(f"Spooled {num_items} {channel} item(s) to {path}.")
+        return path
+
+    def reject(self, path: str) -> str:
+        """Move a spooled batch to the rejected batches. Returns its new path."""
+        with self.lock:
+            os.makedirs(self.rejected_directory, exist_ok=True)
+            rejected_path = os.path.join(
+                self.rejected_directory, os.path.basename(path)
+            )
+            os.replace(path, rejected_path)
+        return rejected_path
+
+    @staticmethod
+    def read(path: str) -> Dict:
+        with open(path, "rb") as spool_file:
+            batch = json.loads(gzip.decompress(spool_file.read()).decode("utf-8"))
+        if batch.pop("body_is_bytes", False):
+            batch["body"] = base64.b64decode(batch["body"])
+        return batch
+
+    @staticmethod
+    def remove(path: str):
+        os.remove(path)
@@ -1,6 +1,7 @@
+from django.http import JsonResponse
 from django.shortcuts import render
 
-from box.models import BoxSettings
+from box.models import BoxSettings, UploadChannelStatus
 from data.models import TmuxStatus
 from data.queries import compute_kpis
 
@@ -26,3 +27,25 @@ def dashboard(request):
     context = {"kpis": kpis, "airodump_ng_status": airodump_ng_status}
     template = "box/dashboard.html"
     return render(request, template, context)
+
+
+def upload_status(request):
+    """How much data is waiting to be uploaded, per channel, and how fast we upload it."""
+    return JsonResponse(
+        {
+            status.channel: dict(
+                backlog=status.backlog,
+                drain_rate=status.drain_rate,
+                batch_size=status.batch_size,
+                bytes_sent=status.bytes_sent,
+                requests=status.requests,
+                retries=status.retries,
+                failures=status.failures,
+                rejected=status.rejected,
+                latency=status.latency,
+                last_upload_at=status.last_upload_at,
+                updated_at=status.updated_at,
+            )
+            for status in UploadChannelStatus.objects.order_by("channel")
+        }
+    )
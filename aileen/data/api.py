@@ -1,9 +1,30 @@
+from datetime import datetime, time, timedelta
+
 from django.http import JsonResponse
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils.dateparse import parse_date, parse_datetime
 
 from data.models import SeenByHour
 from data.queries import prepare_df_datetime_index
 from data.queries import compute_kpis
+from data.bitmaps import compute_return_curve
+from data.queries import count_unique_observables
+from data.sketches import STANDARD_ERROR
+from data.time_utils import aileen_now, as_day, get_timezone
+
+
+def parse_time_parameter(value: str) -> datetime:
+    """Parse an ISO datetime or date (as its midnight). Without a timezone, it is in our timezone.
+    Raises ValueError if this is not a valid datetime or date."""
+    dt = parse_datetime(value)
+    if dt is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"{value} is not an ISO datetime or date.")
+        dt = datetime.combine(day, time())
+    if dt.tzinfo is None:
+        dt = get_timezone().localize(dt)
+    return dt
 
 
 def aggregations_by_box_id(request, box_id=None):
@@ -35,6 +56,57 @@ def aggregations(request):
     return aggregations_by_box_id(request, box_id=None)
 
 
+def unique_observables(request):
+    """
+    Returns the number of unique observables seen between start and end (ISO datetimes, full hours),
+    optionally only on some boxes (box_id can be given more than once).
+    The count is estimated from sketches, unless exact=true is passed.
+    {'unique_observables': 4211, 'exact': false, 'standard_error': 0.016, 'hours_without_sketch': 0}
+    """
+    try:
+        start_time, end_time = [
+            parse_time_parameter(request.GET[param]) for param in ("start", "end")
+        ]
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("Pass start and end as ISO datetimes.")
+    box_ids = request.GET.getlist("box_id") or None
+    exact = request.GET.get("exact", "false").lower() in ("true", "1", "yes")
+
+    count, hours_without_sketch = count_unique_observables(
+        start_time, end_time, box_ids=box_ids, exact=exact
+    )
+    return JsonResponse(
+        dict(
+            unique_observables=count,
+            exact=exact,
+            standard_error=0 if exact else STANDARD_ERROR,
+            hours_without_sketch=hours_without_sketch,
+        )
+    )
+
+
+def return_curve_by_box_id(request, box_id):
+    """
+    For the observables a box saw on a day (ISO date, default yesterday), how many of them it saw
+    exactly lag days earlier, and at any time within lag days before, for lags 1 to max_lag (default 30).
+    This reads the day bitmaps which the aggregator stores for days which are over (see data/bitmaps.py),
+    days without one count as empty.
+    {'day_start': '...', 'seen': 512, 'curve': [{'lag': 1, 'seen_on_day': 80, 'seen_within': 80}, ...],
+     'days_without_bitmap': 0}
+    """
+    try:
+        day = as_day(aileen_now()) - timedelta(days=1)
+        if "day" in request.GET:
+            day = parse_time_parameter(request.GET["day"])
+        max_lag = int(request.GET.get("max_lag", 30))
+    except ValueError:
+        return HttpResponseBadRequest("Pass day as ISO date and max_lag as number.")
+    if not 1 <= max_lag <= 365:
+        return HttpResponseBadRequest("max_lag should be between 1 and 365.")
+
+    return JsonResponse(compute_return_curve(box_id, day, max_lag))
+
+
 def kpis_by_box_id(request, box_id):
     """
     Returns the kpis by box id.
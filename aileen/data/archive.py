@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from data.db_utils import in_batches
+from data.time_utils import naive_utc_from
+
+"""
+Archive of raw events which were moved out of the database (see the archive_events command).
+Events are partitioned by box and (UTC) day, with one file per partition, in one of two formats
+(see AILEEN_EVENTS_ARCHIVE_FORMAT):
+
+- "npz": compressed numpy files with one array per column (smallest, but a file is read as a whole)
+- "sqlite": small SQLite databases with an index on time_seen. Queries attach only the partitions
+  of the days they need, and filter in SQL.
+
+Columns are id, observable_id, time_seen (nanoseconds since the epoch, UTC), value and observations (as JSON).
+Partitions of old days can be dropped as a whole (see drop_archived_days).
+We read partitions in both formats, so the format can be changed at any time. When we add events to a day
+which has a partition in the other format, its events are moved into the partition in the current format.
+"""
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLUMNS = ("id", "observable_id", "time_seen", "value", "observations")
+ARCHIVE_FILE_EXTENSIONS = dict(npz="npz", sqlite="sqlite3")
+
+# SQLite can attach 10 databases to a connection (by default)
+MAX_ATTACHED_PARTITIONS = 10
+
+CREATE_PARTITION_SQL = (
+    "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, observable_id TEXT NOT NULL,"
+    " time_seen INTEGER NOT NULL, value REAL NOT NULL, observations TEXT NOT NULL);"
+    " CREATE INDEX IF NOT EXISTS events_time_seen_observable ON events (time_seen, observable_id);"
+)
+
+
+def get_archive_path(box_id: str, day: date, archive_format: str = None) -> str:
+    if archive_format is None:
+        archive_format = settings.EVENTS_ARCHIVE_FORMAT
+    return os.path.join(
+        settings.EVENTS_ARCHIVE_DIR,
+        box_id,
+        f"events-{day.isoformat()}.{ARCHIVE_FILE_EXTENSIONS[archive_format]}",
+    )
+
+
+def get_archive_paths(box_id: str, day: date) -> Dict[str, str]:
+    """The paths of the partitions of the day which exist, by their format
+    (there is one, unless we changed the format while adding events to the day)."""
+    paths = {
+        archive_format: get_archive_path(box_id, day, archive_format)
+        for archive_format in ARCHIVE_FILE_EXTENSIONS
+    }
+    return {
+        archive_format: path
+        for archive_format, path in paths.items()
+        if os.path.exists(path)
+    }
+
+
+def get_archived_box_ids() -> List[str]:
+    """The boxes of which we have archived events."""
+    if not os.path.isdir(settings.EVENTS_ARCHIVE_DIR):
+        return []
+    return [
+        box_id
+        for box_id in os.listdir(settings.EVENTS_ARCHIVE_DIR)
+        if os.path.isdir(os.path.join(settings.EVENTS_ARCHIVE_DIR, box_id))
+    ]
+
+
+def get_archived_days(
+    box_id: str, start_time: datetime, end_time: datetime
+) -> List[date]:
+    """The UTC days between start_time and end_time for which we have archived events."""
+    day = naive_utc_from(start_time).date()
+    last_day = naive_utc_from(end_time).date()
+    days = []
+    while day <= last_day:
+        if len(get_archive_paths(box_id, day)) > 0:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def has_archived_events(box_id: str, start_time: datetime, end_time: datetime) -> bool:
+    return len(get_archived_days(box_id, start_time, end_time)) > 0
+
+
+def read_partition(path: str, archive_format: str) -> pd.DataFrame:
+    if archive_format == "sqlite":
+        with closing(sqlite3.connect(path)) as connection:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM events ORDER BY id",
+                connection,
+            )
+    with np.load(path) as columns:
+        return pd.DataFrame({column: columns[column] for column in ARCHIVE_COLUMNS})
+
+
+def read_archived_day(box_id: str, day: date) -> pd.DataFrame:
+    partitions = [
+        read_partition(path, archive_format)
+        for archive_format, path in get_archive_paths(box_id, day).items()
+    ]
+    if len(partitions) == 0:
+        return pd.DataFrame(columns=ARCHIVE_COLUMNS)
+    if len(partitions) == 1:
+        return partitions[0]
+    return pd.concat(partitions).drop_duplicates(subset="id").sort_values("id")
+
+
+def write_archived_day(box_id: str, day: date, events_df: pd.DataFrame) -> int:
+    """Add events (with the archive columns, time_seen as nanoseconds since the epoch) to the partition of their day.
+    Events we archived before are kept once. A partition is never half-written.
+    Events of the day in a partition of the other format are moved into this one (after it was written).
+    Returns how many events the day has in the archive now."""
+    path = get_archive_path(box_id, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    other_partitions = {
+        archive_format: other_path
+        for archive_format, other_path in get_archive_paths(box_id, day).items()
+        if archive_format != settings.EVENTS_ARCHIVE_FORMAT
+    }
+    if settings.EVENTS_ARCHIVE_FORMAT == "sqlite":
+        events_df = pd.concat(
+            [
+                read_partition(other_path, archive_format)
+                for archive_format, other_path in other_partitions.items()
+            ]
+            + [events_df[list(ARCHIVE_COLUMNS)]]
+        )
+        with closing(sqlite3.connect(path)) as connection:
+            connection.executescript(CREATE_PARTITION_SQL)
+            with connection:  # one transaction
+                connection.executemany(
+                    "INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?)",
+                    zip(
+                        events_df["id"].astype(int).tolist(),
+                        events_df["observable_id"].astype(str).tolist(),
+                        events_df["time_seen"].astype(np.int64).tolist(),
+                        events_df["value"].astype(float).tolist(),
+                        events_df["observations"].astype(str).tolist(),
+                    ),
+                )
+            num_events = connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        for other_path in other_partitions.values():
+            os.remove(other_path)
+        return num_events
+
+    events_df = (
+        pd.concat([read_archived_day(box_id, day), events_df[list(ARCHIVE_COLUMNS)]])
+        .drop_duplicates(subset="id")
+        .sort_values("id")
+    )
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        id=events_df["id"].values.astype(np.int64),
+        observable_id=events_df["observable_id"].values.astype(str),
+        time_seen=events_df["time_seen"].values.astype(np.int64),
+        value=events_df["value"].values.astype(np.float64),
+        observations=events_df["observations"].values.astype(str),
+    )
+    os.replace(tmp_path, path)
+    for other_path in other_partitions.values():
+        os.remove(other_path)
+    return len(events_df.index)
+
+
+def drop_archived_days(box_id: str, before: date) -> int:
+    """Delete the partitions (in any format) of days before the given one. Returns how many were deleted."""
+    box_dir = os.path.join(settings.EVENTS_ARCHIVE_DIR, box_id)
+    if not os.path.isdir(box_dir):
+        return 0
+    dropped = 0
+    for file_name in sorted(os.listdir(box_dir)):
+        match = re.match(r"^events-(\d{4}-\d{2}-\d{2})\.(npz|sqlite3)$", file_name)
+        if match and datetime.strptime(match.group(1), "%Y-%m-%d").date() < before:
+            os.remove(os.path.join(box_dir, file_name))
+            dropped += 1
+    return dropped
+
+
+def read_archived_events(
+    box_id: str, start_time: datetime, end_time: datetime
+) -> pd.DataFrame:
+    """The archived events of a box in the time window (including its end), with time_seen as UTC datetimes
+    and observations as dicts."""
+    start_ns = pd.Timestamp(naive_utc_from(start_time)).value
+    end_ns = pd.Timestamp(naive_utc_from(end_time)).value
+    days = [
+        read_archived_day(box_id, day)
+        for day in get_archived_days(box_id, start_time, end_time)
+    ]
+    if len(days) == 0:
+        return pd.DataFrame(columns=ARCHIVE_COLUMNS)
+    events_df = pd.concat(days)
+    events_df = events_df[
+        (events_df["time_seen"] >= start_ns) & (events_df["time_seen"] <= end_ns)
+    ].copy()
+    events_df["time_seen"] = pd.to_datetime(events_df["time_seen"], utc=True)
+    events_df["observations"] = events_df["observations"].map(json.loads)
+    return events_df
+
+
+def get_archived_observable_ids_seen(
+    box_id: str, start_time: datetime, end_time: datetime
+) -> List[str]:
+    """Like data.queries.get_unique_observable_ids_seen, but for archived events.
+    Only the partitions of the days in the time window are read (and of these, only the data we need)."""
+    start_ns = pd.Timestamp(naive_utc_from(start_time)).value
+    end_ns = pd.Timestamp(naive_utc_from(end_time)).value
+    paths_by_format = dict(sqlite=[], npz=[])
+    for day in get_archived_days(box_id, start_time, end_time):
+        for archive_format, path in get_archive_paths(box_id, day).items():
+            paths_by_format[archive_format].append(path)
+    observable_ids = set()
+    for batch in in_batches(paths_by_format["sqlite"], MAX_ATTACHED_PARTITIONS):
+        with closing(sqlite3.connect(":memory:")) as connection:
+            for i, path in enumerate(batch):
+                connection.execute(f"ATTACH DATABASE ? AS p{i}", (path,))
+            observable_ids.update(
+                row[0]
+                for row in connection.execute(
+                    " UNION ".join(
+                        f"SELECT observable_id FROM p{i}.events WHERE time_seen BETWEEN ? AND ?"
+                        for i in range(len(batch))
+                    ),
+                    [start_ns, end_ns] * len(batch),
+                )
+            )
+    for path in paths_by_format["npz"]:
+        with np.load(path) as columns:
+            times_seen = columns["time_seen"]
+            in_window = (times_seen >= start_ns) & (times_seen <= end_ns)
+            observable_ids.update(columns["observable_id"][in_window].tolist())
+    return list(observable_ids)
@@ -0,0 +1,315 @@
+import logging
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from data.archive import get_archived_observable_ids_seen, has_archived_events
+from data.db_utils import in_batches, insert_ignoring_conflicts
+from data.models import (
+    Events,
+    ObservableNumbers,
+    SeenByDay,
+    SeenByDayBitmap,
+    SeenByHourBitmap,
+)
+from data.time_utils import (
+    aileen_now,
+    as_aileen_time,
+    as_day,
+    get_timezone,
+    naive_utc_from,
+)
+
+"""
+Sets of observables as bitmaps: each observable gets an integer number (see ObservableNumbers),
+and the observables seen on a box in an hour are stored as a bitmap of these numbers (see SeenByHourBitmap).
+Then "seen in both time windows" is a bitwise AND, and longer time windows are ORs of hours - without touching Events.
+Days have their own bitmaps (see SeenByDayBitmap), from which we compute return curves over many lags.
+The aggregator builds them, once a day is over.
+"""
+
+logger = logging.getLogger(__name__)
+
+# events can come in this late, so we only trust bitmaps of time windows which ended longer ago than this
+LATE_EVENTS_PERIOD = timedelta(hours=2)
+
+
+class ObservableBitmap:
+    """A set of observable numbers, as a bit array (packed into bytes). We store it zlib-compressed,
+    which makes the long runs of zeros in sparse bitmaps cheap."""
+
+    def __init__(self, packed_bits: np.ndarray = None):
+        if packed_bits is None:
+            packed_bits = np.zeros(0, dtype=np.uint8)
+        self.packed_bits = packed_bits
+
+    @classmethod
+    def from_numbers(cls, numbers: Iterable[int]) -> "ObservableBitmap":
+        numbers = np.fromiter(numbers, dtype=np.int64)
+        if len(numbers) == 0:
+            return cls()
+        bits = np.zeros(numbers.max() + 1, dtype=bool)
+        bits[numbers] = True
+        return cls(np.packbits(bits))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ObservableBitmap":
+        return cls(np.frombuffer(zlib.decompress(bytes(data)), dtype=np.uint8))
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(self.packed_bits.tobytes())
+
+    def numbers(self) -> np.ndarray:
+        return np.flatnonzero(np.unpackbits(self.packed_bits))
+
+    def _aligned(self, other: "ObservableBitmap") -> Tuple[np.ndarray, np.ndarray]:
+        length = max(len(self.packed_bits), len(other.packed_bits))
+        return (
+            np.pad(self.packed_bits, (0, length - len(self.packed_bits)), "constant"),
+            np.pad(other.packed_bits, (0, length - len(other.packed_bits)), "constant"),
+        )
+
+    def __and__(self, other: "ObservableBitmap") -> "ObservableBitmap":
+        return ObservableBitmap(np.bitwise_and(*self._aligned(other)))
+
+    def __or__(self, other: "ObservableBitmap") -> "ObservableBitmap":
+        return ObservableBitmap(np.bitwise_or(*self._aligned(other)))
+
+    def __len__(self):
+        return int(np.unpackbits(self.packed_bits).sum())
+
+
+def number_observables_seen(box_id: str, start_time: datetime, end_time: datetime):
+    """Give a number to each observable seen in the time window which does not have one yet."""
+    new_observable_ids = (
+        Events.objects.filter(box_id=box_id)
+        .filter(time_seen__gte=start_time)
+        .filter(time_seen__lte=end_time)
+        .filter(observable__observablenumbers__isnull=True)
+        .values_list("observable_id", flat=True)
+        .distinct()
+    )
+    insert_ignoring_conflicts(
+        ObservableNumbers,
+        [
+            ObservableNumbers(observable_id=observable_id)
+            for observable_id in new_observable_ids
+        ],
+    )
+
+
+def get_observable_numbers(observable_ids: List[str]) -> List[int]:
+    """The numbers of these observables. Those which do not have a number yet get one."""
+    insert_ignoring_conflicts(
+        ObservableNumbers,
+        [
+            ObservableNumbers(observable_id=observable_id)
+            for observable_id in observable_ids
+        ],
+    )
+    numbers = []
+    for batch in in_batches(observable_ids):
+        numbers.extend(
+            ObservableNumbers.objects.filter(observable_id__in=batch).values_list(
+                "id", flat=True
+            )
+        )
+    return numbers
+
+
+def get_bitmap_from_events(
+    box_id: str, start_time: datetime, end_time: datetime
+) -> ObservableBitmap:
+    """Make the bitmap of observables seen in the time window (including its end, like the aggregations do).
+    Events which were archived already (see data/archive.py) are included."""
+    number_observables_seen(box_id, start_time, end_time)
+    numbers = list(
+        Events.objects.filter(box_id=box_id)
+        .filter(time_seen__gte=start_time)
+        .filter(time_seen__lte=end_time)
+        .values_list("observable__observablenumbers__id", flat=True)
+        .distinct()
+    )
+    if has_archived_events(box_id, start_time, end_time):
+        numbers.extend(
+            get_observable_numbers(
+                get_archived_observable_ids_seen(box_id, start_time, end_time)
+            )
+        )
+    return ObservableBitmap.from_numbers(numbers)
+
+
+def build_hour_bitmap(
+    box_id: str, hour_start: datetime, store: bool = True
+) -> ObservableBitmap:
+    """Make the bitmap of observables seen in the hour and (if store is True) store it."""
+    bitmap = get_bitmap_from_events(box_id, hour_start, hour_start + timedelta(hours=1))
+    if store:
+        SeenByHourBitmap.objects.update_or_create(
+            box_id=box_id,
+            hour_start=hour_start,
+            defaults=dict(bitmap=bitmap.to_bytes()),
+        )
+    return bitmap
+
+
+def build_day_bitmap(
+    box_id: str, day_start: datetime, day_end: datetime
+) -> ObservableBitmap:
+    """Make the bitmap of observables seen on the day and store it."""
+    bitmap = get_bitmap_from_events(box_id, day_start, day_end)
+    SeenByDayBitmap.objects.update_or_create(
+        box_id=box_id, day_start=day_start, defaults=dict(bitmap=bitmap.to_bytes())
+    )
+    return bitmap
+
+
+def get_hour_bitmaps(
+    box_id: str, start_time: datetime, end_time: datetime
+) -> Dict[datetime, ObservableBitmap]:
+    """Get the bitmaps of the hours starting from start_time (which should be the start of an hour) until end_time.
+    We only store bitmaps of closed hours. The current hour is built anew each time, and so are closed hours
+    of the last two hours (late events can still come in). Older hours are only built if we did not store them yet.
+    Hours which did not start yet have empty bitmaps."""
+    hour_starts = []
+    hour_start = start_time
+    while hour_start < end_time:
+        hour_starts.append(hour_start)
+        hour_start += timedelta(hours=1)
+    if len(hour_starts) == 0:
+        return {}
+    stored_bitmaps = {
+        stored.hour_start: ObservableBitmap.from_bytes(stored.bitmap)
+        for stored in SeenByHourBitmap.objects.filter(box_id=box_id)
+        .filter(hour_start__gte=hour_starts[0])
+        .filter(hour_start__lte=hour_starts[-1])
+    }
+    now = aileen_now()
+    recent = now - LATE_EVENTS_PERIOD
+    bitmaps = {}
+    for hour_start in hour_starts:
+        if hour_start > now:
+            bitmaps[hour_start] = ObservableBitmap()
+        elif hour_start in stored_bitmaps and hour_start < recent:
+            bitmaps[hour_start] = stored_bitmaps[hour_start]
+        else:
+            bitmaps[hour_start] = build_hour_bitmap(
+                box_id, hour_start, store=hour_start + timedelta(hours=1) <= now
+            )
+    return bitmaps
+
+
+def get_bitmap_of_observables_seen(
+    box_id: str, start_time: datetime, end_time: datetime
+) -> ObservableBitmap:
+    """The observables seen in the time window (from the start of an hour to the end of an hour), as one bitmap."""
+    bitmap = ObservableBitmap()
+    for hour_bitmap in get_hour_bitmaps(box_id, start_time, end_time).values():
+        bitmap = bitmap | hour_bitmap
+    return bitmap
+
+
+def count_unique_observables_seen_in_bitmaps(
+    box_id: str,
+    start_time: datetime,
+    end_time: datetime,
+    also_seen_between: List[Tuple[datetime, datetime]] = (),
+) -> List[int]:
+    """Like data.queries.count_unique_observables_seen, but from hour bitmaps.
+    Time windows need to start and end at full hours."""
+    seen = get_bitmap_of_observables_seen(box_id, start_time, end_time)
+    return [len(seen)] + [
+        len(seen & get_bitmap_of_observables_seen(box_id, *other_window))
+        for other_window in also_seen_between
+    ]
+
+
+def get_day_starts(last_day: datetime, num_days: int) -> List[datetime]:
+    """The starts of num_days days (in our timezone), from the earliest until the day of last_day.
+    We step in local days, so days around a DST change start at midnight, too."""
+    timezone = get_timezone()
+    last_day = as_day(as_aileen_time(last_day)).replace(tzinfo=None)
+    return [
+        timezone.localize(last_day - timedelta(days=days_back))
+        for days_back in range(num_days - 1, -1, -1)
+    ]
+
+
+def get_next_day_start(day_start: datetime) -> datetime:
+    local_day = as_day(as_aileen_time(day_start)).replace(tzinfo=None)
+    return get_timezone().localize(local_day + timedelta(days=1))
+
+
+def build_closed_day_bitmaps(box_id: str, since: datetime) -> int:
+    """Build and store the bitmaps of the days since the given time which are over (for long enough,
+    see LATE_EVENTS_PERIOD) and aggregated, but have no bitmap yet. Returns how many we built."""
+    now = aileen_now()
+    stored_days = {
+        naive_utc_from(day_start)
+        for day_start in SeenByDayBitmap.objects.filter(box_id=box_id)
+        .filter(day_start__gte=since)
+        .values_list("day_start", flat=True)
+    }
+    built = 0
+    for day_start in (
+        SeenByDay.objects.filter(box_id=box_id)
+        .filter(day_start__gte=since)
+        .order_by("day_start")
+        .values_list("day_start", flat=True)
+    ):
+        day_end = get_next_day_start(day_start)
+        if (
+            naive_utc_from(day_start) in stored_days
+            or day_end + LATE_EVENTS_PERIOD > now
+        ):
+            continue
+        build_day_bitmap(box_id, day_start, day_end)
+        built += 1
+    if built > 0:
+        logger.info(f"Built the bitmaps of {built} day(s) on box {box_id}.")
+    return built
+
+
+def get_day_bitmaps(
+    box_id: str, day_starts: List[datetime]
+) -> Dict[datetime, ObservableBitmap]:
+    """Get the stored bitmaps of these days (in one query). Days without a stored bitmap
+    (because they are not over yet, or were not aggregated) are left out."""
+    if len(day_starts) == 0:
+        return {}
+    return {
+        stored.day_start: ObservableBitmap.from_bytes(stored.bitmap)
+        for stored in SeenByDayBitmap.objects.filter(box_id=box_id)
+        .filter(day_start__gte=min(day_starts))
+        .filter(day_start__lte=max(day_starts))
+    }
+
+
+def compute_return_curve(box_id: str, day_start: datetime, max_lag: int = 30) -> Dict:
+    """
+    For the observables seen on a day, find out how many of them were seen before, for lags of 1 to max_lag days:
+    - seen_on_day: how many were also seen exactly lag days earlier
+    - seen_within: how many were seen at any time within the lag days before (this grows with the lag)
+    We need the stored day bitmaps of the max_lag + 1 days, and then go through them once.
+    Days without a bitmap count as empty, and we return how many there were.
+    """
+    day_starts = get_day_starts(day_start, max_lag + 1)
+    bitmaps = get_day_bitmaps(box_id, day_starts)
+    days_without_bitmap = len([day for day in day_starts if day not in bitmaps])
+    seen = bitmaps.get(day_starts[-1], ObservableBitmap())
+    seen_before = ObservableBitmap()
+    curve = []
+    for lag, earlier_day_start in enumerate(reversed(day_starts[:-1]), start=1):
+        earlier_day = seen & bitmaps.get(earlier_day_start, ObservableBitmap())
+        seen_before = seen_before | earlier_day
+        curve.append(
+            dict(lag=lag, seen_on_day=len(earlier_day), seen_within=len(seen_before))
+        )
+    return dict(
+        day_start=day_starts[-1],
+        seen=len(seen),
+        curve=curve,
+        days_without_bitmap=days_without_bitmap,
+    )
@@ -0,0 +1,67 @@
+from typing import Iterable, Iterator, List
+
+from django.db import connections, models, router
+
+"""
+Helpers for set-based database work, which we need on busy boxes where per-row queries are too slow.
+"""
+
+# SQLite allows at most 999 query parameters per statement, so we keep batches well below that.
+BULK_BATCH_SIZE = 300
+
+
+def in_batches(items: Iterable, batch_size: int = BULK_BATCH_SIZE) -> Iterator[List]:
+    """Yield lists of at most batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def insert_ignoring_conflicts(model, objs: List[models.Model]) -> int:
+    """Insert model instances in batches, skipping the ones which would violate a unique constraint.
+    Return how many rows were actually inserted.
+    Django (1.11) cannot do this, so we write the SQL ourselves (for SQLite and PostgreSQL)."""
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor == "sqlite":
+        insert_sql, conflict_sql = "INSERT OR IGNORE INTO", ""
+    elif connection.vendor == "postgresql":
+        insert_sql, conflict_sql = "INSERT INTO", " ON CONFLICT DO NOTHING"
+    else:
+        raise Exception(
+            "Inserting while ignoring conflicts is not supported on %s."
+            % connection.vendor
+        )
+    qn = connection.ops.quote_name
+    fields = [
+        field
+        for field in model._meta.concrete_fields
+        if not isinstance(field, models.AutoField)
+    ]
+    row_sql = "(%s)" % ", ".join(["%s"] * len(fields))
+    batch_size = min(BULK_BATCH_SIZE, connection.ops.bulk_batch_size(fields, objs))
+
+    inserted = 0
+    with connection.cursor() as cursor:
+        for batch in in_batches(objs, max(batch_size, 1)):
+            cursor.execute(
+                "%s %s (%s) VALUES %s%s"
+                % (
+                    insert_sql,
+                    qn(model._meta.db_table),
+                    ", ".join(qn(field.column) for field in fields),
+                    ", ".join([row_sql] * len(batch)),
+                    conflict_sql,
+                ),
+                [
+                    field.get_db_prep_save(field.pre_save(obj, True), connection)
+                    for obj in batch
+                    for field in fields
+                ],
+            )
+            inserted += cursor.rowcount
+    return inserted
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0003_auto_20190624_1438'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObservableNumbers',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('observable', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='data.Observables')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SeenByHourBitmap',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('box_id', models.CharField(max_length=256)),
+                ('hour_start', models.DateTimeField()),
+                ('bitmap', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='seenbyhourbitmap',
+            unique_together=set([('box_id', 'hour_start')]),
+        ),
+    ]
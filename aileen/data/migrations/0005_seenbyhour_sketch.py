@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0004_observable_numbers_and_hour_bitmaps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seenbyhour',
+            name='sketch',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
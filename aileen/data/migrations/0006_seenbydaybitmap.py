@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0005_seenbyhour_sketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeenByDayBitmap',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('box_id', models.CharField(max_length=256)),
+                ('day_start', models.DateTimeField()),
+                ('bitmap', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='seenbydaybitmap',
+            unique_together=set([('box_id', 'day_start')]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0006_seenbydaybitmap'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='events',
+            index=models.Index(fields=['box_id', 'time_seen', 'observable'], name='events_box_time_obs_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='events',
+            index=models.Index(fields=['box_id', 'id'], name='events_box_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tmuxstatus',
+            index=models.Index(fields=['sensor_status', 'time_stamp'], name='tmuxstatus_status_time_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:20
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_days(apps, schema_editor):
+    """Keep one SeenByDay per box and day (the one saved last), so the unique constraint can be added."""
+    SeenByDay = apps.get_model("data", "SeenByDay")
+    duplicates = (
+        SeenByDay.objects.values("box_id", "day_start")
+        .annotate(count=Count("id"), last_id=Max("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        SeenByDay.objects.filter(
+            box_id=duplicate["box_id"], day_start=duplicate["day_start"]
+        ).exclude(id=duplicate["last_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_days, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='seenbyday',
+            unique_together=set([('box_id', 'day_start')]),
+        ),
+    ]
@@ -1,16 +1,24 @@
+from collections import defaultdict
 from datetime import datetime
 
 import pandas as pd
+from pandas.api.types import is_datetime64tz_dtype
 from django.db import models
+from django.db.models import Case, Value, When
 
 # we get generic json support from a third-party lib,
 # even though native support would be given - but for pg/mysql only.
 from jsonfield import JSONField
 from django_pandas.managers import DataFrameManager
 
+from data.db_utils import in_batches, insert_ignoring_conflicts
+
 
 """ Data models shared between boxes and servers. This is the core data we are collecting."""
 
+# In bulk upserts, a time_last_seen shared by at least this many observables gets its own UPDATE statement
+MIN_OBSERVABLES_PER_SHARED_UPDATE = 10
+
 
 class Observables(models.Model):
 
@@ -36,8 +44,11 @@ class Observables(models.Model):
         return Observables.objects.filter(observable_id=observable_id).first()
 
     @staticmethod
-    def save_from_df(df: pd.DataFrame) -> int:
-        """Save observables in the df to the database. Return how many were newly created."""
+    def save_from_df(df: pd.DataFrame, bulk: bool = False) -> int:
+        """Save observables in the df to the database. Return how many were newly created.
+        With bulk=True, this uses a few set-based statements instead of two queries per observable."""
+        if bulk:
+            return Observables.bulk_save_from_df(df)
         created = 0
         for observable in df.reset_index(level=0).to_dict("records"):
             observable_id = observable["observable_id"]
@@ -50,6 +61,92 @@ class Observables(models.Model):
                 observable.time_first_seen = observable.time_last_seen
         return created
 
+    @staticmethod
+    def bulk_save_from_df(df: pd.DataFrame, keep_latest: bool = False) -> int:
+        """Upsert observables in the df (indexed by observable_id, with a time_last_seen column).
+        We look up which ones exist, insert the new ones (skipping the ones inserted meanwhile)
+        and update time_last_seen of the others, all in batches. Return how many were newly created.
+
+        With keep_latest=True, an observable keeps the latest time_last_seen we know of (in the df or the database),
+        e.g. when boxes upload observables they saw at different times.
+
+        Sensors report time at a coarse resolution, so many observables in one reading share their time_last_seen.
+        Those get updated together, the rest is updated per batch with one CASE statement."""
+        if keep_latest:
+            was_tz_aware = is_datetime64tz_dtype(df["time_last_seen"])
+            df = df.groupby(level=0)[["time_last_seen"]].max()
+            # the times are compared with (aware) times from the database, so the max has to keep its timezone
+            # (some pandas versions return it as naive UTC)
+            if was_tz_aware and not is_datetime64tz_dtype(df["time_last_seen"]):
+                df["time_last_seen"] = df["time_last_seen"].dt.tz_localize("UTC")
+        else:
+            df = df[~df.index.duplicated(keep="last")]
+        last_seen = {
+            observable_id: pd.Timestamp(time_last_seen).to_pydatetime()
+            for observable_id, time_last_seen in df["time_last_seen"].items()
+        }
+
+        existing_last_seen = {}
+        for batch in in_batches(last_seen.keys()):
+            existing_last_seen.update(
+                Observables.objects.filter(observable_id__in=batch).values_list(
+                    "observable_id", "time_last_seen"
+                )
+            )
+
+        new_observables = [
+            Observables(observable_id=observable_id, time_last_seen=time_last_seen)
+            for observable_id, time_last_seen in last_seen.items()
+            if observable_id not in existing_last_seen
+        ]
+        # another request (e.g. a box uploading the same observables) might insert some of them meanwhile
+        created = insert_ignoring_conflicts(Observables, new_observables)
+        if created < len(new_observables):
+            for batch in in_batches(new_observables):
+                existing_last_seen.update(
+                    Observables.objects.filter(
+                        observable_id__in=[
+                            observable.observable_id for observable in batch
+                        ]
+                    ).values_list("observable_id", "time_last_seen")
+                )
+
+        existing_ids = [
+            observable_id
+            for observable_id, time_last_seen in existing_last_seen.items()
+            if (
+                time_last_seen < last_seen[observable_id]
+                if keep_latest
+                else time_last_seen != last_seen[observable_id]
+            )
+        ]
+        ids_by_time_last_seen = defaultdict(list)
+        for observable_id in existing_ids:
+            ids_by_time_last_seen[last_seen[observable_id]].append(observable_id)
+        ids_with_rare_times = []
+        for time_last_seen, observable_ids in ids_by_time_last_seen.items():
+            if len(observable_ids) < MIN_OBSERVABLES_PER_SHARED_UPDATE:
+                ids_with_rare_times.extend(observable_ids)
+                continue
+            for batch in in_batches(observable_ids):
+                Observables.objects.filter(observable_id__in=batch).update(
+                    time_last_seen=time_last_seen
+                )
+        for batch in in_batches(ids_with_rare_times):
+            Observables.objects.filter(observable_id__in=batch).update(
+                time_last_seen=Case(
+                    *[
+                        When(
+                            observable_id=observable_id,
+                            then=Value(last_seen[observable_id]),
+                        )
+                        for observable_id in batch
+                    ],
+                    output_field=models.DateTimeField(),
+                )
+            )
+        return created
+
     @staticmethod
     def to_df():
         return Observables.pdobjects.all().to_dataframe(index="observable_id")
@@ -66,6 +163,15 @@ class Events(models.Model):
 
     class Meta:
         unique_together = (("observable", "time_seen"),)
+        indexes = [
+            # finding observables seen by a box in a time window (covers the observable, too)
+            models.Index(
+                fields=["box_id", "time_seen", "observable"],
+                name="events_box_time_obs_idx",
+            ),
+            # finding events of a box which were not uploaded yet
+            models.Index(fields=["box_id", "id"], name="events_box_id_idx"),
+        ]
 
     objects = models.Manager()
     pdobjects = DataFrameManager()
@@ -80,12 +186,15 @@ class Events(models.Model):
         )
 
     @staticmethod
-    def save_from_df(events_df: pd.DataFrame, box_id: str) -> int:
+    def save_from_df(events_df: pd.DataFrame, box_id: str, bulk: bool = False) -> int:
         """Save events in the df to the database. Return how many were newly created.
+        With bulk=True, events are inserted in batches and the ones we already have are skipped.
         """
         created = 0
         if box_id is None or box_id == "":
             raise Exception("No Box ID given.")
+        if bulk:
+            return Events.bulk_save_from_df(events_df, box_id)
         for event in events_df.reset_index(level=0).to_dict("records"):
             event["box_id"] = box_id
 
@@ -110,6 +219,25 @@ class Events(models.Model):
                 created += 1
         return created
 
+    @staticmethod
+    def bulk_save_from_df(events_df: pd.DataFrame, box_id: str) -> int:
+        """Insert events in the df in batches. Events we already know of (same observable and time_seen,
+        which is our unique constraint) are skipped by the database. Return how many were newly created."""
+        for expected_column in ("time_seen", "value", "observations"):
+            if expected_column not in events_df.columns:
+                raise Exception("%s missing in the event data." % expected_column)
+        events = [
+            Events(
+                box_id=box_id,
+                observable_id=event["observable_id"],
+                time_seen=pd.Timestamp(event["time_seen"]).to_pydatetime(),
+                value=event["value"],
+                observations=event["observations"],
+            )
+            for event in events_df.reset_index(level=0).to_dict("records")
+        ]
+        return insert_ignoring_conflicts(Events, events)
+
     @staticmethod
     def find_by_observable_id(observable_id: str) -> pd.DataFrame:
         return Events.pdobjects.filter(observable_id=observable_id).to_dataframe()
@@ -124,6 +252,8 @@ class SeenByHour(models.Model):
     hour_start = models.DateTimeField()
     seen = models.IntegerField()
     seen_also_in_preceding_hour = models.IntegerField()
+    # HyperLogLog sketch of the observables seen (see data/sketches.py), if AGGREGATION_SKETCHES is on
+    sketch = models.BinaryField(null=True, blank=True)
 
     objects = models.Manager()
     pdobjects = DataFrameManager()
@@ -138,6 +268,50 @@ class SeenByHour(models.Model):
         return str(self)
 
 
+class ObservableNumbers(models.Model):
+    """Integer surrogates of observable IDs (the id of a row is the number of its observable),
+    so that sets of observables can be stored as bitmaps (see data/bitmaps.py)."""
+
+    observable = models.OneToOneField(Observables, on_delete=models.CASCADE)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"<ObservableNumber {self.id} for {self.observable_id}>"
+
+
+class SeenByHourBitmap(models.Model):
+    """The observables seen on a box in an hour, as a compressed bitmap of their numbers (next to SeenByHour)."""
+
+    box_id = models.CharField(max_length=256)
+    hour_start = models.DateTimeField()
+    bitmap = models.BinaryField()
+
+    objects = models.Manager()
+
+    class Meta:
+        unique_together = (("box_id", "hour_start"),)
+
+    def __str__(self):
+        return f"<SeenByHourBitmap for {self.hour_start} on box {self.box_id}>"
+
+
+class SeenByDayBitmap(models.Model):
+    """The observables seen on a box on a day, as a compressed bitmap of their numbers (next to SeenByDay)."""
+
+    box_id = models.CharField(max_length=256)
+    day_start = models.DateTimeField()
+    bitmap = models.BinaryField()
+
+    objects = models.Manager()
+
+    class Meta:
+        unique_together = (("box_id", "day_start"),)
+
+    def __str__(self):
+        return f"<SeenByDayBitmap for {self.day_start} on box {self.box_id}>"
+
+
 class SeenByDay(models.Model):
     box_id = models.CharField(max_length=256, unique_for_date="day")
     day_start = models.DateTimeField()
@@ -170,5 +344,14 @@ class TmuxStatus(models.Model):
 
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            # finding times in which the sensor was on
+            models.Index(
+                fields=["sensor_status", "time_stamp"],
+                name="tmuxstatus_status_time_idx",
+            )
+        ]
+
     def __str__(self):
         return f"Box={self.box_id} time={self.time_stamp} sensor status={self.sensor_status}"
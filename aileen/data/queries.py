@@ -1,11 +1,19 @@
 import logging
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, Iterable, List, Tuple
 
 import pandas as pd
 from django.conf import settings
-
+from django.db.models import Case, Count, Max, When
+
+from data.archive import (
+    get_archived_box_ids,
+    get_archived_observable_ids_seen,
+    has_archived_events,
+)
+from data.db_utils import in_batches
 from data.models import Events, SeenByDay, SeenByHour
+from data.sketches import HyperLogLog
 
 """
 TODO: these are not all "queries". Two of these are very special (pandas-related) utility functions.
@@ -91,7 +99,8 @@ def number_of_times_observable_was_seen_per_bin_size(df: pd.DataFrame, bin_size:
 def get_unique_observable_ids_seen(
     box_id: str, start_time: datetime, end_time: datetime
 ) -> List[str]:
-    return [
+    """Also finds observables of events which were archived (see data/archive.py)."""
+    observable_ids = [
         row["observable_id"]
         for row in Events.objects.filter(box_id=box_id)
         .filter(time_seen__gte=start_time)
@@ -100,6 +109,125 @@ def get_unique_observable_ids_seen(
         .distinct()
         .all()
     ]
+    if has_archived_events(box_id, start_time, end_time):
+        observable_ids = list(
+            set(observable_ids).union(
+                get_archived_observable_ids_seen(box_id, start_time, end_time)
+            )
+        )
+    return observable_ids
+
+
+def count_unique_observables_seen(
+    box_id: str,
+    start_time: datetime,
+    end_time: datetime,
+    also_seen_between: List[Tuple[datetime, datetime]] = (),
+) -> List[int]:
+    """Count the distinct observables seen in a time window, and how many of them were also seen
+    in each of the other time windows. The database does all set operations, in one query.
+    Time windows include their borders, like in get_unique_observable_ids_seen."""
+    counts = dict(
+        seen=Count("observable_id", distinct=True),
+        **{
+            f"also_seen_{i}": Count(
+                Case(
+                    When(
+                        observable_id__in=Events.objects.filter(box_id=box_id)
+                        .filter(time_seen__gte=other_start_time)
+                        .filter(time_seen__lte=other_end_time)
+                        .values("observable_id"),
+                        then="observable_id",
+                    )
+                ),
+                distinct=True,
+            )
+            for i, (other_start_time, other_end_time) in enumerate(also_seen_between)
+        },
+    )
+    results = (
+        Events.objects.filter(box_id=box_id)
+        .filter(time_seen__gte=start_time)
+        .filter(time_seen__lte=end_time)
+        .aggregate(**counts)
+    )
+    return [results["seen"]] + [
+        results[f"also_seen_{i}"] for i in range(len(also_seen_between))
+    ]
+
+
+def count_unique_observables(
+    start_time: datetime,
+    end_time: datetime,
+    box_ids: List[str] = None,
+    exact: bool = False,
+) -> Tuple[int, int]:
+    """Count the distinct observables seen from start_time until end_time, on the given boxes (or all).
+    By default, we merge the HyperLogLog sketches of the hourly aggregations in the time range
+    (which should start and end at full hours), in constant memory and with a standard error of
+    about 1.6% (see data/sketches.py). The exact count needs the events (also the archived ones),
+    so it is meant for short windows.
+    Returns the count and the number of hours in the range which have no sketch (and thus were not counted)."""
+    if exact:
+        events = Events.objects.filter(time_seen__gte=start_time).filter(
+            time_seen__lte=end_time
+        )
+        if box_ids is not None:
+            events = events.filter(box_id__in=box_ids)
+        archived_box_ids = [
+            box_id
+            for box_id in (box_ids if box_ids is not None else get_archived_box_ids())
+            if has_archived_events(box_id, start_time, end_time)
+        ]
+        if len(archived_box_ids) == 0:
+            return (
+                events.aggregate(seen=Count("observable_id", distinct=True))["seen"],
+                0,
+            )
+        observable_ids = set(events.values_list("observable_id", flat=True).distinct())
+        for box_id in archived_box_ids:
+            observable_ids.update(
+                get_archived_observable_ids_seen(box_id, start_time, end_time)
+            )
+        return len(observable_ids), 0
+
+    aggregations = SeenByHour.objects.filter(hour_start__gte=start_time).filter(
+        hour_start__lt=end_time
+    )
+    if box_ids is not None:
+        aggregations = aggregations.filter(box_id__in=box_ids)
+    merged_sketch = HyperLogLog()
+    hours_without_sketch = 0
+    for sketch in aggregations.values_list("sketch", flat=True).iterator():
+        if sketch is None:
+            hours_without_sketch += 1
+            continue
+        merged_sketch = merged_sketch.merge(HyperLogLog.from_bytes(sketch))
+    if hours_without_sketch > 0:
+        logger.warning(
+            f"{hours_without_sketch} hourly aggregation(s) have no sketch and are not counted."
+        )
+    return merged_sketch.count(), hours_without_sketch
+
+
+def get_latest_events(observable_ids: Iterable[str]) -> pd.DataFrame:
+    """Get the latest event of each of these observables, as a dataframe indexed by observable_id
+    (with time_seen, value and observations). We need one query per batch of observables."""
+    latest_events = []
+    for batch in in_batches(observable_ids):
+        latest_event_ids = (
+            Events.objects.filter(observable_id__in=batch)
+            .values("observable_id")
+            .annotate(latest_id=Max("id"))
+            .values("latest_id")
+        )
+        latest_events.extend(
+            (event.observable_id, event.time_seen, event.value, event.observations)
+            for event in Events.objects.filter(id__in=latest_event_ids)
+        )
+    return pd.DataFrame(
+        latest_events, columns=["observable_id", "time_seen", "value", "observations"]
+    ).set_index("observable_id")
 
 
 def compute_kpis(box_id="None") -> Dict:
@@ -11,6 +11,12 @@ urlpatterns = [
         name="aggregations_by_box_id",
     ),
     url(r"^api/aggregations/", api.aggregations, name="aggregations"),
+    url(r"^api/unique_observables/", api.unique_observables, name="unique_observables"),
+    url(
+        r"^api/return_curve_by_box_id/(?P<box_id>[^/]+)/",
+        api.return_curve_by_box_id,
+        name="return_curve_by_box_id",
+    ),
     url(
         r"^api/kpis_by_box_id/(?P<box_id>[^/]+)/",
         api.kpis_by_box_id,
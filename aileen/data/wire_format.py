@@ -0,0 +1,162 @@
+import gzip
+import json
+import logging
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+import pytz
+from django.conf import settings
+
+from data.models import Events, Observables
+from data.time_utils import naive_utc_from
+
+"""
+The compact format in which boxes upload events (and their observables) to the server.
+It is columnar JSON, gzip-compressed:
+- each observable ID is sent once per batch, events refer to it by its position in the batch
+- event IDs and times (microseconds since the epoch, UTC) are delta-encoded, so they are mostly small numbers
+
+Boxes use it once the server told them it understands it (in the UPLOAD_FORMATS_HEADER of a response),
+otherwise they send the Django-serialized JSON as before. Version 1 looks like this:
+
+{"version": 1, "box_id": "...",
+ "observables": {"observable_id": [...], "time_last_seen": [<first time>, <delta>, ...]},
+ "events": {"id": [<first id>, <delta>, ...], "observable": [<index in observables>, ...],
+            "time_seen": [<first time>, <delta>, ...], "value": [...], "observations": [...]}}
+"""
+
+logger = logging.getLogger(__name__)
+
+WIRE_FORMAT_VERSION = 1
+SUPPORTED_WIRE_FORMAT_VERSIONS = (WIRE_FORMAT_VERSION,)
+CONTENT_TYPE = "application/vnd.aileen.events+json"
+# the server lists the versions it understands in this header, boxes say which one they send in the other one
+UPLOAD_FORMATS_HEADER = "X-Aileen-Upload-Formats"
+UPLOAD_FORMAT_HEADER = "X-Aileen-Upload-Format"
+# servers which can save the sketches of hourly aggregations (see data/sketches.py) also list this in the header,
+# older ones cannot deserialize aggregations with a sketch
+SKETCHES_UPLOAD_FORMAT = "sketches"
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_microseconds(dt: datetime) -> int:
+    return (naive_utc_from(dt) - EPOCH) // (datetime.resolution)
+
+
+def from_microseconds(microseconds: int) -> datetime:
+    return pytz.utc.localize(EPOCH + microseconds * datetime.resolution)
+
+
+def delta_encode(numbers: List[int]) -> List[int]:
+    return [number - previous for number, previous in zip(numbers, [0] + numbers[:-1])]
+
+
+def delta_decode(deltas: List[int]) -> List[int]:
+    numbers, total = [], 0
+    for delta in deltas:
+        total += delta
+        numbers.append(total)
+    return numbers
+
+
+def encode_events(
+    box_id: str, events: List[Events], observables: Iterable[Observables]
+) -> bytes:
+    observables = list(observables)
+    observable_indices = {
+        observable.observable_id: i for i, observable in enumerate(observables)
+    }
+    batch = dict(
+        version=WIRE_FORMAT_VERSION,
+        box_id=box_id,
+        observables=dict(
+            observable_id=[observable.observable_id for observable in observables],
+            time_last_seen=delta_encode(
+                [
+                    to_microseconds(observable.time_last_seen)
+                    for observable in observables
+                ]
+            ),
+        ),
+        events=dict(
+            id=delta_encode([event.id for event in events]),
+            observable=[observable_indices[event.observable_id] for event in events],
+            time_seen=delta_encode(
+                [to_microseconds(event.time_seen) for event in events]
+            ),
+            value=[event.value for event in events],
+            observations=[event.observations for event in events],
+        ),
+    )
+    return gzip.compress(json.dumps(batch, separators=(",", ":")).encode("utf-8"))
+
+
+class InvalidUpload(Exception):
+    """The server cannot take an upload as it was sent (so it responds with 400)."""
+
+    pass
+
+
+class UploadTooLarge(InvalidUpload):
+    pass
+
+
+def decompress(data: bytes, max_size: int = None) -> bytes:
+    """Decompress gzipped data, but not beyond max_size bytes (so a small upload cannot fill our memory)."""
+    if max_size is None:
+        max_size = settings.UPLOAD_MAX_DECOMPRESSED_BYTES
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    decompressed = decompressor.decompress(data, max_size)
+    if not decompressor.eof and (
+        decompressor.unconsumed_tail or len(decompressed) >= max_size
+    ):
+        raise UploadTooLarge(f"Upload decompresses to more than {max_size} bytes.")
+    return decompressed
+
+
+def decode_events(data: bytes) -> Tuple[List[Observables], List[Events]]:
+    """Make (unsaved) observables and events from an uploaded batch."""
+    if data[:2] == b"\x1f\x8b":  # a proxy might have decompressed it already
+        data = decompress(data)
+    try:
+        batch: Dict = json.loads(data.decode("utf-8"))
+        version = batch.get("version")
+    except (ValueError, AttributeError) as e:
+        raise InvalidUpload(f"Upload is not a JSON object: {e}")
+    if version not in SUPPORTED_WIRE_FORMAT_VERSIONS:
+        raise InvalidUpload(f"Upload format version {version} is not supported.")
+    try:
+        return _decode_batch(batch)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        raise InvalidUpload(f"Upload is not a valid batch: {e!r}")
+
+
+def _decode_batch(batch: Dict) -> Tuple[List[Observables], List[Events]]:
+    observable_ids = batch["observables"]["observable_id"]
+    observables = [
+        Observables(observable_id=observable_id, time_last_seen=from_microseconds(time))
+        for observable_id, time in zip(
+            observable_ids, delta_decode(batch["observables"]["time_last_seen"])
+        )
+    ]
+    columns = batch["events"]
+    events = [
+        Events(
+            id=event_id,
+            box_id=batch["box_id"],
+            observable_id=observable_ids[observable_index],
+            time_seen=from_microseconds(time_seen),
+            value=value,
+            observations=observations,
+        )
+        for event_id, observable_index, time_seen, value, observations in zip(
+            delta_decode(columns["id"]),
+            columns["observable"],
+            delta_decode(columns["time_seen"]),
+            columns["value"],
+            columns["observations"],
+        )
+    ]
+    return observables, events
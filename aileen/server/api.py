@@ -1,18 +1,31 @@
 import logging
 
+import pandas as pd
+from django.core.exceptions import RequestDataTooBig
 from django.core.serializers import deserialize
+from django.core.serializers.base import DeserializationError
 from django.db import transaction
 from django.http import (
     HttpResponse,
     HttpResponseBadRequest,
     HttpResponseForbidden,
     HttpResponseNotFound,
+    HttpResponseServerError,
     JsonResponse,
 )
 from django.views.decorators.csrf import csrf_exempt
 
-from data.models import SeenByDay, SeenByHour, Observables
+from data.db_utils import insert_ignoring_conflicts
+from data.models import Events, SeenByDay, SeenByHour, Observables
 from data.queries import prepare_df_datetime_index
+from data.wire_format import (
+    SKETCHES_UPLOAD_FORMAT,
+    SUPPORTED_WIRE_FORMAT_VERSIONS,
+    UPLOAD_FORMAT_HEADER,
+    UPLOAD_FORMATS_HEADER,
+    InvalidUpload,
+    decode_events,
+)
 from server.models import AileenBox
 
 logger = logging.getLogger(__name__)
@@ -20,9 +33,18 @@ logger = logging.getLogger(__name__)
 
 def box_data_receiver(func):
     """Decorator for post endpoints which receive data from boxes.
-    Performs checks and wraps endpoint code in try/except handling and an atomic db transaction."""
+    Performs checks and wraps endpoint code in try/except handling and an atomic db transaction.
+    Responses tell boxes which compact upload formats we understand (see data/wire_format.py)."""
 
     def wrapper(request, box_id):
+        response = receive(request, box_id)
+        response[UPLOAD_FORMATS_HEADER] = ",".join(
+            [str(version) for version in SUPPORTED_WIRE_FORMAT_VERSIONS]
+            + [SKETCHES_UPLOAD_FORMAT]
+        )
+        return response
+
+    def receive(request, box_id):
         # check method
         if request.method not in ("POST", "PUT"):
             logger.warning(f"Got {request.method} request, only POST is allowed.")
@@ -43,12 +65,20 @@ def box_data_receiver(func):
             logger.error(f"Box with id {box_id} could not be found.")
             return HttpResponseNotFound("No box")
 
+        # boxes send a batch again later if we respond with 5xx, but not if we tell them it is invalid (400)
         try:
             with transaction.atomic():
                 func(request, box_id)
-        except Exception as e:
-            logger.error(str(e))
+        except RequestDataTooBig as e:
+            # boxes send smaller batches after a 413
+            logger.error(f"Upload from Box {box_id} is too large: {e}")
+            return HttpResponse(str(e), status=413)
+        except (InvalidUpload, DeserializationError) as e:
+            logger.error(f"Invalid upload from Box {box_id}: {e}")
             return HttpResponseBadRequest(str(e))
+        except Exception as e:
+            logger.exception(f"Could not save the upload from Box {box_id}: {e}")
+            return HttpResponseServerError(str(e))
 
         return HttpResponse(200)
 
@@ -63,32 +93,53 @@ def post_events(request, box_id):
 
     Expects JSON data for observables and events, like this:
     {"observables": [ ...], "events": [ ... ]}
+    or, if the box sends the UPLOAD_FORMAT_HEADER, a batch in that compact format (see data/wire_format.py).
     """
 
     logger.info(f"Got event data for Box {box_id}")
 
     # deserialize
-    observables = list(deserialize("json", request.POST.get("observables", "[]")))
+    upload_format = request.META.get(
+        f"HTTP_{UPLOAD_FORMAT_HEADER.upper().replace('-', '_')}"
+    )
+    if upload_format is not None:
+        observables, events = decode_events(request.body)
+        logger.info(f"Received upload format {upload_format}.")
+    else:
+        observables = [
+            deserialized.object
+            for deserialized in deserialize(
+                "json", request.POST.get("observables", "[]")
+            )
+        ]
+        events = [
+            deserialized.object
+            for deserialized in deserialize("json", request.POST.get("events", {}))
+        ]
     logger.info(f"Received {len(observables)} observables.")
-    events = list(deserialize("json", request.POST.get("events", {})))
     logger.info(f"Received {len(events)} events.")
-    for observable in observables:
-        existing_observable = Observables.objects.filter(
-            observable_id=observable.object.observable_id
-        ).first()
-        if (
-            existing_observable
-            and existing_observable.time_last_seen > observable.object.time_last_seen
-        ):
-            observable.object.time_last_seen = existing_observable.time_last_seen
-        observable.save()
-
     for event in events:
-        if event.object.box_id != box_id:
-            raise Exception(
-                f"Event with box_id {event.object.box_id} was sent, while request box_id is {box_id}."
+        if event.box_id != box_id:
+            raise InvalidUpload(
+                f"Event with box_id {event.box_id} was sent, while request box_id is {box_id}."
             )
-        event.save()
+
+    # observables keep the latest time_last_seen (the box might have sent an older one than we know of)
+    Observables.bulk_save_from_df(
+        pd.DataFrame(
+            dict(
+                time_last_seen=[observable.time_last_seen for observable in observables]
+            ),
+            index=pd.Index(
+                [observable.observable_id for observable in observables],
+                name="observable_id",
+            ),
+        ),
+        keep_latest=True,
+    )
+    # events are unique by observable and time_seen, the ones we have already (e.g. from a retry) are skipped
+    created = insert_ignoring_conflicts(Events, events)
+    logger.info(f"Saved {created} new events.")
 
 
 @csrf_exempt
@@ -110,7 +161,7 @@ def post_aggregations(request, box_id):
 
     for sb in seen_by_hour + seen_by_day:
         if sb.object.box_id != box_id:
-            raise Exception(
+            raise InvalidUpload(
                 f"SeenByHour with box_id {sb.object.box_id} was sent, while request box_id is {box_id}."
             )
         sb.save()
@@ -132,7 +183,7 @@ def post_tmux_status(request, box_id):
     logger.info(f"Received {len(tmux_statuss)} tmux statuss'.")
     for status in tmux_statuss:
         if status.object.box_id != box_id:
-            raise Exception(
+            raise InvalidUpload(
                 f"Status with box_id {status.object.box_id} was send, while request box_id is {box_id}."
             )
         status.save()
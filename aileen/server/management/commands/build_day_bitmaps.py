@@ -0,0 +1,31 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from data.bitmaps import build_closed_day_bitmaps
+from data.time_utils import aileen_now
+from server.models import AileenBox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the bitmaps of days which are over, for the return curves of all boxes."
+        " On a box, the aggregator does this. Servers can run it daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--look-back-in-days",
+            type=int,
+            default=settings.AGGREGATION_LOOK_BACK_IN_DAYS,
+            help="Build bitmaps of days this far back (default: AILEEN_AGGREGATION_LOOK_BACK_IN_DAYS).",
+        )
+
+    def handle(self, *args, **options):
+        since = aileen_now() - timedelta(days=options["look_back_in_days"])
+        for box_id in AileenBox.objects.values_list("box_id", flat=True):
+            build_closed_day_bitmaps(box_id, since)
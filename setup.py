@@ -28,6 +28,7 @@ setup(
         "pytz",
         "requests",
     ],
+    extras_require={"inotify": ["inotify_simple"]},
     setup_requires=["pytest-runner"],
     tests_require=["pytest", "requests"],
     packages=["aileen"],